@@ -1,7 +1,10 @@
 import os
 import re
 import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
 from pathlib import Path
+from typing import Generic, TypeVar
 from dotenv import load_dotenv
 
 import discord
@@ -14,7 +17,7 @@ from features.minesweeper import (
     DIFFICULTY,
 )
 
-from features.gomoku import GomokuGame, X, O
+from features.gomoku import GomokuGame, NotAITurnError, X, O
 from features.gomoku_render import render_gomoku_png
 from features.shogi import ShogiGame, SENTE, GOTE
 from features.shogi_render import render_shogi_png
@@ -26,13 +29,79 @@ TOKEN = os.getenv("DISCORD_TOKEN")
 if not TOKEN:
     raise RuntimeError("DISCORD_TOKEN が取得できていません。.env または環境変数を確認してください。")
 
-gomoku_games: dict[int, GomokuGame] = {}
-shogi_games: dict[int, ShogiGame] = {}
+T = TypeVar("T")
 
-MOVE_RE = re.compile(r"^\s*(\d{1,2})\s+(\d{1,2})\s*$")
-SHOGI_MOVE_RE = re.compile(r"^[1-9]{4}$")
-SHOGI_DROP_RE = re.compile(r"^(fu|kyou|kei|gin|kin|kaku|hisya|ou)[1-9]{2}$", re.IGNORECASE)
-SHOGI_YN_RE = re.compile(r"^[ynYN]$")
+# 何かしらの対局が進行中のスレッド: thread.id -> 対局数（五目と将棋が同じスレッドに並ぶこともある）
+# on_message はまずここだけを見て、対局の無いスレッドのメッセージを捨てる
+active_thread_ids: dict[int, int] = {}
+
+
+class ShardedGames(Generic[T]):
+    """
+    thread.id -> 対局 のテーブル。
+    thread.id の下位ビットでシャードに分け、シャード毎に asyncio.Lock を持つ。
+    登録/削除は active_thread_ids にも反映する。
+    """
+
+    def __init__(self, shards: int = 32):
+        # shards は2の冪（下位ビットのマスクでシャードを選ぶ）
+        self._mask = shards - 1
+        self.shards: list[dict[int, T]] = [{} for _ in range(shards)]
+        self.locks = [asyncio.Lock() for _ in range(shards)]
+
+    def __contains__(self, key: int) -> bool:
+        return key in self.shards[key & self._mask]
+
+    def __setitem__(self, key: int, value: T) -> None:
+        shard = self.shards[key & self._mask]
+        if key not in shard:
+            active_thread_ids[key] = active_thread_ids.get(key, 0) + 1
+        shard[key] = value
+
+    def get(self, key: int) -> T | None:
+        return self.shards[key & self._mask].get(key)
+
+    def pop(self, key: int, default: T | None = None) -> T | None:
+        shard = self.shards[key & self._mask]
+        if key not in shard:
+            return default
+        left = active_thread_ids.pop(key) - 1
+        if left:
+            active_thread_ids[key] = left
+        return shard.pop(key)
+
+    def discard(self, key: int, value: T) -> None:
+        """key に value が登録されたままなら外す（await の間に別の対局へ入れ替わっていたら何もしない）"""
+        if self.get(key) is value:
+            self.pop(key)
+
+    def lock(self, key: int) -> asyncio.Lock:
+        return self.locks[key & self._mask]
+
+
+gomoku_games: ShardedGames[GomokuGame] = ShardedGames()
+shogi_games: ShardedGames[ShogiGame] = ShardedGames()
+
+# AI探索は重いので、描画（asyncio.to_thread の既定プール）とは別のプールで回す。
+# 探索が長引いても他スレッドの盤面画像の送信が待たされない。
+AI_EXECUTOR = ThreadPoolExecutor(max_workers=2, thread_name_prefix="gomoku-ai")
+
+# 将棋の入力（移動 `7776` / 打ち駒 `fu77`）を1回の照合で分類する
+SHOGI_RE = re.compile(
+    r"(?P<mv>[1-9]{4})|(?P<drop>fu|kyou|kei|gin|kin|kaku|hisya|ou)(?P<dt>[1-9]{2})",
+    re.IGNORECASE,
+)
+SHOGI_YN = ("y", "Y", "n", "N")
+SHOGI_DROP_KINDS = {
+    "fu": "P",
+    "kyou": "L",
+    "kei": "N",
+    "gin": "S",
+    "kin": "G",
+    "kaku": "B",
+    "hisya": "R",
+    "ou": "K",
+}
 
 
 class MyClient(discord.Client):
@@ -95,18 +164,51 @@ def _fmt_user(u: discord.User | discord.Member) -> str:
     return getattr(u, "display_name", u.name)
 
 
+def _cached_png(game: GomokuGame | ShogiGame, render) -> bytes:
+    """盤面（手数・勝敗）が前回描画から変わっていなければ、前回のPNGを使い回す"""
+    # キーは描画より先に読む。move_count は手が確定してから最後に上がるので、描画中に次の手が入って
+    # 新しい盤面を古いキーで覚えても、そのキーで引かれることはない
+    key = (game.move_count, game.finished, game.winner)
+    cached = game._png_cache
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    png = render(game)
+    game._png_cache = (key, png)
+    return png
+
+
+async def _ai_move(game: GomokuGame) -> tuple[int, int] | None:
+    """探索に入る前に投了・終了で AI の番でなくなっていたら None（探索中の他の例外はそのまま上げる）"""
+    try:
+        return await asyncio.get_running_loop().run_in_executor(AI_EXECUTOR, game.ai_move)
+    except NotAITurnError:
+        return None
+
+
+async def _play_ai_turn(thread: discord.Thread, game: GomokuGame) -> None:
+    """
+    AIの手を指して盤面を送る。探索中もイベントループは動くので、その間に投了・終了・
+    同じスレッドでの新しい対局の開始があった場合は何もしない。
+    """
+    move = await _ai_move(game)
+    if move is None or gomoku_games.get(thread.id) is not game or not game.is_ai_turn():
+        return
+    ax, ay = move
+    game._place_raw(ax, ay, game.turn)
+    await _send_board_image(thread, game, note=f"AI move: {ax+1} {ay+1}")
+    if game.finished:
+        gomoku_games.discard(thread.id, game)
+
+
 async def _send_board_image(thread: discord.Thread, game: GomokuGame, *, note: str | None = None):
-    png = render_gomoku_png(game)
-    if note:
-        await thread.send(note)
-    await thread.send(file=discord.File(fp=png, filename="gomoku.png"))
+    png = await asyncio.to_thread(_cached_png, game, render_gomoku_png)
+    # note と画像は1回の送信にまとめる（discord.File はストリームを読み切るので毎回 BytesIO を作る）
+    await thread.send(content=note, file=discord.File(fp=BytesIO(png), filename="gomoku.png"))
 
 
 async def _send_shogi_image(thread: discord.Thread, game: ShogiGame, *, note: str | None = None):
-    png = await asyncio.to_thread(render_shogi_png, game)
-    if note:
-        await thread.send(note)
-    await thread.send(file=discord.File(fp=png, filename="shogi.png"))
+    png = await asyncio.to_thread(_cached_png, game, render_shogi_png)
+    await thread.send(content=note, file=discord.File(fp=BytesIO(png), filename="shogi.png"))
 
 
 @client.tree.command(name="gomoku_start", description="五目並べを開始（publicスレッド 1440分で続行）")
@@ -192,34 +294,34 @@ async def gomoku_start(
             f"五目並べスレッドを作成しました。続きはここで進行します: {thread.jump_url}"
         )
 
-    if thread.id in gomoku_games:
-        await thread.send("このスレッドでは既に対局が進行中です。終了してから開始してください。")
-        return
+    # 開始メッセージ送信（await）を挟んでも二重開始にならないよう、確認から登録までをロックする
+    async with gomoku_games.lock(thread.id):
+        if thread.id in gomoku_games:
+            await thread.send("このスレッドでは既に対局が進行中です。終了してから開始してください。")
+            return
 
-    if mode.value == "pvp" and opponent:
-        if want_side == "X":
-            game = GomokuGame(size=board_size, mode="pvp", player_x=starter.id, player_o=opponent.id)
-            await thread.send(f"開始: 先手={starter.mention}, 後手={opponent.mention}（先手のみ禁じ手あり）")
-        else:
-            game = GomokuGame(size=board_size, mode="pvp", player_x=opponent.id, player_o=starter.id)
-            await thread.send(f"開始: 先手={opponent.mention}, 後手={starter.mention}（先手のみ禁じ手あり）")
-    else:
-        lvl = difficulty.value if difficulty else "hard"
-        if want_side == "X":
-            game = GomokuGame(size=board_size, mode="ai", player_x=starter.id, player_o=None, ai_level=lvl)
-            await thread.send(f"開始: 先手={starter.mention}, 後手=AI (level={lvl})（先手のみ禁じ手あり）")
+        if mode.value == "pvp" and opponent:
+            if want_side == "X":
+                game = GomokuGame(size=board_size, mode="pvp", player_x=starter.id, player_o=opponent.id)
+                await thread.send(f"開始: 先手={starter.mention}, 後手={opponent.mention}（先手のみ禁じ手あり）")
+            else:
+                game = GomokuGame(size=board_size, mode="pvp", player_x=opponent.id, player_o=starter.id)
+                await thread.send(f"開始: 先手={opponent.mention}, 後手={starter.mention}（先手のみ禁じ手あり）")
         else:
-            game = GomokuGame(size=board_size, mode="ai", player_x=None, player_o=starter.id, ai_level=lvl)
-            await thread.send(f"開始: 先手=AI (level={lvl}), 後手={starter.mention}（先手のみ禁じ手あり）")
+            lvl = difficulty.value if difficulty else "hard"
+            if want_side == "X":
+                game = GomokuGame(size=board_size, mode="ai", player_x=starter.id, player_o=None, ai_level=lvl)
+                await thread.send(f"開始: 先手={starter.mention}, 後手=AI (level={lvl})（先手のみ禁じ手あり）")
+            else:
+                game = GomokuGame(size=board_size, mode="ai", player_x=None, player_o=starter.id, ai_level=lvl)
+                await thread.send(f"開始: 先手=AI (level={lvl}), 後手={starter.mention}（先手のみ禁じ手あり）")
 
-    gomoku_games[thread.id] = game
+        gomoku_games[thread.id] = game
     await _send_board_image(thread, game)
     await thread.send("操作: スレッド内で `x y` を送信（例: `8 8`）")
 
     if game.mode == "ai" and game.is_ai_turn():
-        ax, ay = game.ai_move()
-        game._place_raw(ax, ay, game.turn)
-        await _send_board_image(thread, game, note=f"AI move: {ax+1} {ay+1}")
+        await _play_ai_turn(thread, game)
 
 
 @client.tree.command(name="gomoku_show", description="盤面を再表示（スレッド内）")
@@ -236,8 +338,8 @@ async def gomoku_show(interaction: discord.Interaction):
         await interaction.response.send_message("このスレッドには進行中の対局がありません。")
         return
 
-    png = render_gomoku_png(game)
-    await interaction.response.send_message(file=discord.File(fp=png, filename="gomoku.png"))
+    png = await asyncio.to_thread(_cached_png, game, render_gomoku_png)
+    await interaction.response.send_message(file=discord.File(fp=BytesIO(png), filename="gomoku.png"))
 
 
 @client.tree.command(name="gomoku_resign", description="投了（スレッド内）")
@@ -359,8 +461,8 @@ async def shogi_show(interaction: discord.Interaction):
         await interaction.response.send_message("このスレッドには進行中の将棋対局がありません。")
         return
 
-    png = await asyncio.to_thread(render_shogi_png, game)
-    await interaction.response.send_message(file=discord.File(fp=png, filename="shogi.png"))
+    png = await asyncio.to_thread(_cached_png, game, render_shogi_png)
+    await interaction.response.send_message(file=discord.File(fp=BytesIO(png), filename="shogi.png"))
 
 
 @client.tree.command(name="shogi_resign", description="将棋の投了（スレッド内）")
@@ -427,6 +529,8 @@ async def on_message(message: discord.Message):
         return
 
     thread = message.channel
+    if thread.id not in active_thread_ids:
+        return
 
     # 将棋
     shogi_game = shogi_games.get(thread.id)
@@ -435,10 +539,9 @@ async def on_message(message: discord.Message):
             return
 
         text = message.content.strip()
-        lower = text.lower()
 
         if shogi_game.pending_move is not None:
-            if SHOGI_YN_RE.fullmatch(text):
+            if text in SHOGI_YN:
                 ok, msg = shogi_game.confirm_pending(message.author.id, promote=(text.lower() == "y"))
                 if not ok:
                     await thread.send(f"{message.author.mention} {msg}")
@@ -448,13 +551,14 @@ async def on_message(message: discord.Message):
                     shogi_games.pop(thread.id, None)
                 return
 
-            if SHOGI_MOVE_RE.fullmatch(text) or SHOGI_DROP_RE.fullmatch(lower):
+            if SHOGI_RE.fullmatch(text):
                 await thread.send(f"{message.author.mention} まず y/n を答えてください。")
             else:
                 await thread.send(f"{message.author.mention} 成りますか？ y/n で答えてください。")
             return
 
-        if SHOGI_MOVE_RE.fullmatch(text):
+        m = SHOGI_RE.fullmatch(text)
+        if m and m.group("mv"):
             fx, fy, tx, ty = map(int, text)
             ok, msg, pending = shogi_game.request_move(fx, fy, tx, ty, message.author.id)
             if not ok:
@@ -468,21 +572,10 @@ async def on_message(message: discord.Message):
                 shogi_games.pop(thread.id, None)
             return
 
-        if SHOGI_DROP_RE.fullmatch(lower):
-            romaji_to_kind = {
-                "fu": "P",
-                "kyou": "L",
-                "kei": "N",
-                "gin": "S",
-                "kin": "G",
-                "kaku": "B",
-                "hisya": "R",
-                "ou": "K",
-            }
-            kind_token = lower[:-2]
-            kind = romaji_to_kind[kind_token]
-            tx = int(lower[-2])
-            ty = int(lower[-1])
+        if m and m.group("drop"):
+            kind = SHOGI_DROP_KINDS[m.group("drop").lower()]
+            tx = int(m.group("dt")[0])
+            ty = int(m.group("dt")[1])
             ok, msg, _ = shogi_game.request_drop(kind, tx, ty, message.author.id)
             if not ok:
                 await thread.send(f"{message.author.mention} {msg}")
@@ -503,12 +596,16 @@ async def on_message(message: discord.Message):
     if not game.can_play(message.author.id):
         return
 
-    m = MOVE_RE.match(message.content)
-    if not m:
+    # `x y`（1〜2桁の数字2つ）だけを手として扱う
+    parts = message.content.split()
+    if len(parts) != 2:
+        return
+    sx, sy = parts
+    if not (sx.isdecimal() and sy.isdecimal() and len(sx) <= 2 and len(sy) <= 2):
         return
 
-    x = int(m.group(1))
-    y = int(m.group(2))
+    x = int(sx)
+    y = int(sy)
 
     ok, msg = game.place(x, y, message.author.id)
     if not ok:
@@ -518,15 +615,11 @@ async def on_message(message: discord.Message):
     await _send_board_image(thread, game)
 
     if game.finished:
-        gomoku_games.pop(thread.id, None)
+        gomoku_games.discard(thread.id, game)
         return
 
     if game.mode == "ai" and game.is_ai_turn():
-        ax, ay = game.ai_move()
-        game._place_raw(ax, ay, game.turn)
-        await _send_board_image(thread, game, note=f"AI move: {ax+1} {ay+1}")
-        if game.finished:
-            gomoku_games.pop(thread.id, None)
+        await _play_ai_turn(thread, game)
 
 
 client.run(TOKEN)
@@ -2,17 +2,224 @@ from __future__ import annotations
 
 from dataclasses import dataclass
 import random
-from typing import Optional, Tuple, List, Iterable, Set
+import time
+from typing import Optional, Tuple, List, Iterable, Iterator, Set, Dict
 
 EMPTY = 0
 X = 1  # 先手（黒）
 O = 2  # 後手（白）
 
+_INF = 10**18
+_WIN = 10**9
+_FUTILITY_MARGIN = 30_000  # 葉の直前でこれ以上負けていたら静かな手は読まない
+_TACTICAL_SCORE = 25_000  # _eval_move がこれ以上 = 四を作る/止める手
+_ASPIRATION = 20_000  # 反復深化で、前の深さの評価値 ± これの窓でまず読む
+_HARD_TIME_BUDGET_MS = 3_000  # hard はこれを超えたら次の深さに進まない
+
+# 置換表（Zobrist hash -> (残り深さ, 評価値, flag, 最善手)）
+_TT_EXACT = 0
+_TT_LOWER = 1  # 評価値は下限（beta cut）
+_TT_UPPER = 2  # 評価値は上限（alpha 以下）
+_TT_SIZE = 1 << 16  # これを超えたら作り直す（ゲーム毎に持つのでメモリを抑える）
+_EVAL_CACHE_SIZE = 1 << 16  # 葉の静的評価のキャッシュも同じく
+
+# 線の4方向（横/縦/斜め/逆斜め）
+_DIRS = ((1, 0), (0, 1), (1, 1), (1, -1))
+
 
 def _inside(n: int, x: int, y: int) -> bool:
     return 0 <= x < n and 0 <= y < n
 
 
+def _line_score(p: int, length: int, open_ends: int) -> int:
+    """1方向の連の長さ・開いた端の数に対する点数（_eval_move 用）"""
+    if p == O:
+        if length >= 5:
+            return 1_000_000
+        if length == 4:
+            return 120_000 if open_ends == 2 else (30_000 if open_ends == 1 else 0)
+        if length == 3:
+            return 12_000 if open_ends == 2 else (3_000 if open_ends == 1 else 0)
+        if length == 2:
+            return 1_200 if open_ends == 2 else (300 if open_ends == 1 else 0)
+        return 0
+
+    if length >= 5:
+        return 800_000
+    if length == 4:
+        return 110_000 if open_ends == 2 else (25_000 if open_ends == 1 else 0)
+    if length == 3:
+        return 11_000 if open_ends == 2 else (2_500 if open_ends == 1 else 0)
+    if length == 2:
+        return 1_000 if open_ends == 2 else (250 if open_ends == 1 else 0)
+    return 0
+
+
+# _LINE_SCORE[p][min(length, 5)][open_ends]（import 時に一度だけ作る）
+_LINE_SCORE = {
+    p: [[_line_score(p, length, open_ends) for open_ends in range(3)] for length in range(6)]
+    for p in (X, O)
+}
+
+
+def _zobrist_table(n: int) -> List[List[List[int]]]:
+    """Zobrist hash の乱数表。[y][x][who]、EMPTY は 0（盤サイズ毎に固定の値）"""
+    rng = random.Random(0)
+    return [[[0, rng.getrandbits(64), rng.getrandbits(64)] for _ in range(n)] for _ in range(n)]
+
+
+# bot が選ばせる盤サイズ分は import 時に作っておき、対局開始時に作らない
+_ZOBRIST = {n: _zobrist_table(n) for n in (9, 11, 13, 15)}
+
+
+def _run_through_center(pattern: int) -> int:
+    """11ビットの窓で、中央（bit 5）を含む連続した1の長さ"""
+    if not pattern >> 5 & 1:
+        return 0
+    length = 1
+    k = 4
+    while k >= 0 and pattern >> k & 1:
+        length += 1
+        k -= 1
+    k = 6
+    while k <= 10 and pattern >> k & 1:
+        length += 1
+        k += 1
+    return length
+
+
+# _RUN_LEN[窓] = 中央を通る連の長さ（前後5マスまで見れば 5/6以上 の区別には足りる）
+_RUN_LEN = [_run_through_center(pat) for pat in range(1 << 11)]
+
+
+def _run_ends(pattern: int) -> int:
+    """11ビットの窓で、中央を通る連の両端のすぐ外側のマス（窓の外に出る側は立てない）"""
+    length = _run_through_center(pattern)
+    if not length:
+        return 0
+    lo = 5
+    while lo > 0 and pattern >> (lo - 1) & 1:
+        lo -= 1
+    hi = lo + length  # 連の右端の次
+    ends = 0
+    if lo > 0:
+        ends |= 1 << (lo - 1)
+    if hi <= 10:
+        ends |= 1 << hi
+    return ends
+
+
+# _RUN_ENDS[窓] = 連の端の外側のマス。空きマスの窓と AND して立っているビット数が open ends
+# （連が5以上なら open ends は点数に関係しないので、窓の外にはみ出しても構わない）
+_RUN_ENDS = [_run_ends(pat) for pat in range(1 << 11)]
+_POPCOUNT = [bin(v).count("1") for v in range(1 << 11)]
+
+
+def _bit_shifts(n: int) -> List[Tuple[int, int, int, int]]:
+    """
+    ビットボード用の配置。[y * n + x] -> 横/縦/斜め/逆斜め それぞれの盤での (bit位置 - 5)。
+    方向毎に「その方向の1本の線」が連続したビットになるよう並べ、線と線の間に
+    常に0の1ビットを挟む（連が隣の線へ繋がらない）。先頭に5ビット空けておくので、
+    (bb >> shift) & 0x7FF がそのマスを中央にした前後5マスの窓になる。
+    """
+    w = n + 1
+    return [
+        (
+            y * w + x,
+            x * w + y,
+            (x - y + n - 1) * w + x,
+            (x + y) * w + x,
+        )
+        for y in range(n)
+        for x in range(n)
+    ]
+
+
+_BIT_SHIFTS = {n: _bit_shifts(n) for n in (9, 11, 13, 15)}
+
+
+def _bit_inside(n: int) -> Tuple[int, int, int, int]:
+    """方向毎のビットボードで、盤内のマスに当たるビットだけ立てたもの（空きマス = 盤内 & ~黒 & ~白）"""
+    shifts = _bit_shifts(n)
+    return tuple(sum(32 << sh[d] for sh in shifts) for d in range(4))
+
+
+_BIT_INSIDE = {n: _bit_inside(n) for n in (9, 11, 13, 15)}
+
+
+def _open_three_empties(stones: int) -> Tuple[int, ...]:
+    """
+    11マスの窓（中央 = bit 5）の黒石の並び -> 両開き三になるために空いていなければならないマスの組。
+    形 .XXX. / .XX.X. / .X.XX. を中央を含む全ての位置にずらし、黒石が揃っているものだけ残す。
+    """
+    out = []
+    for pattern in (".XXX.", ".XX.X.", ".X.XX."):
+        for i in range(11 - len(pattern) + 1):
+            if not i <= 5 < i + len(pattern):
+                continue
+            need_x = sum(1 << (i + k) for k, ch in enumerate(pattern) if ch == "X")
+            need_empty = sum(1 << (i + k) for k, ch in enumerate(pattern) if ch == ".")
+            if stones & need_x == need_x and need_empty not in out:
+                out.append(need_empty)
+    return tuple(out)
+
+
+_OPEN_THREE_EMPTIES = [_open_three_empties(stones) for stones in range(1 << 11)]
+
+
+def _rays(n: int) -> List[Tuple[Tuple[int, ...], ...]]:
+    """
+    [y * n + x][d] -> (x,y) から d 方向に盤端まで進んだマスの添字（(x,y) 自身は含まない）。
+    d = 0..3 は _DIRS の向き、d + 4 はその逆向き。
+    """
+    dirs = _DIRS + tuple((-dx, -dy) for dx, dy in _DIRS)
+    out = []
+    for y in range(n):
+        for x in range(n):
+            cell = []
+            for dx, dy in dirs:
+                ray = []
+                cx, cy = x + dx, y + dy
+                while _inside(n, cx, cy):
+                    ray.append(cy * n + cx)
+                    cx += dx
+                    cy += dy
+                cell.append(tuple(ray))
+            out.append(tuple(cell))
+    return out
+
+
+_RAYS = {n: _rays(n) for n in (9, 11, 13, 15)}
+
+# 近傍カウントは半径1/2/3の個数を8ビットずつ1つの int に詰める（半径3以内の石は高々48個）
+_NEAR_RADII = 3
+_NEAR_DELTA = {1: 0x010101, 2: 0x010100, 3: 0x010000}  # 距離 d の石が数える半径（d 以上）
+
+
+def _near_cells(n: int) -> List[List[Tuple[Tuple[Tuple[int, int], int], ...]]]:
+    """[y][x] -> そのマスから半径3以内の盤内マスと、近傍カウントに足す値"""
+    r = _NEAR_RADII
+    return [
+        [
+            tuple(
+                ((x + dx, y + dy), _NEAR_DELTA[max(abs(dx), abs(dy))])
+                for dy in range(-r, r + 1)
+                for dx in range(-r, r + 1)
+                if (dx or dy) and _inside(n, x + dx, y + dy)
+            )
+            for x in range(n)
+        ]
+        for y in range(n)
+    ]
+
+
+_NEAR_CELLS = {n: _near_cells(n) for n in (9, 11, 13, 15)}
+
+
+class NotAITurnError(RuntimeError):
+    """AIの番でないのに ai_move が呼ばれた（探索を別スレッドで始める前に投了・終了された場合など）"""
+
+
 @dataclass
 class GomokuGame:
     size: int
@@ -24,9 +231,35 @@ class GomokuGame:
     finished: bool = False
     winner: Optional[int] = None  # X/O
     last_move: Optional[Tuple[int, int]] = None  # 0-index (x,y)
+    move_count: int = 0  # 盤面に置かれた手数
 
     def __post_init__(self):
-        self.board: List[List[int]] = [[EMPTY for _ in range(self.size)] for _ in range(self.size)]
+        # 盤面は1本の bytearray（1マス1バイト, EMPTY/X/O）。(x,y) は board[y * size + x]
+        self.board = bytearray(self.size * self.size)
+        # 色毎・方向毎のビットボード bb[who] = [横, 縦, 斜め, 逆斜め]（board と常に同期させる）。
+        # bb[EMPTY] は空きマス（最初は盤内の全マス）
+        self._bit_shifts = _BIT_SHIFTS.get(self.size) or _bit_shifts(self.size)
+        inside = _BIT_INSIDE.get(self.size) or _bit_inside(self.size)
+        self.bb: List[List[int]] = [list(inside), [0, 0, 0, 0], [0, 0, 0, 0]]
+        self._rays = _RAYS.get(self.size) or _rays(self.size)
+        # 空きマスの数（_put/_remove で増減。引き分け判定を O(1) にする）
+        self.empty_count = self.size * self.size
+        # 盤上の石と、各マスの「半径1/2/3以内の石の数」（_put/_remove で増減。0 になったマスは消す）
+        self.stones: Set[Tuple[int, int]] = set()
+        self._near: Dict[Tuple[int, int], int] = {}
+        self._near_cells = _NEAR_CELLS.get(self.size) or _near_cells(self.size)
+
+        # Zobrist hash（盤面の差分更新用）
+        self._zobrist = _ZOBRIST.get(self.size) or _zobrist_table(self.size)
+        self.hash = 0
+        # 置換表はゲームと一緒に生き残るので、次の ai_move でも再利用される
+        self._tt: Dict[int, Tuple[int, int, int, Optional[Tuple[int, int]]]] = {}
+        # 葉の静的評価（(hash, 手番) -> 評価値）。反復深化の浅い深さの葉は、次の深さの futility 判定で再び評価される
+        self._eval_cache: Dict[Tuple[int, int], int] = {}
+        # 描画キャッシュ: ((move_count, finished, winner), PNG bytes)
+        self._png_cache: Optional[Tuple[tuple, bytes]] = None
+        # easy/normal の手のばらつき用（ゲーム毎に持ち、他の対局のスレッドと共有しない）
+        self._rng = random.Random()
 
     # ---------------- common ----------------
 
@@ -69,7 +302,7 @@ class GomokuGame:
         y = y1 - 1
         if not _inside(self.size, x, y):
             return False, f"範囲外です。1〜{self.size}で指定してください。"
-        if self.board[y][x] != EMPTY:
+        if self.board[y * self.size + x] != EMPTY:
             return False, "そこには既に石があります。"
 
         ok, msg = self._place_with_rules(x, y, self.turn)
@@ -77,255 +310,292 @@ class GomokuGame:
 
     def _place_raw(self, x: int, y: int, who: int) -> None:
         """内部用：合法性チェックなしで置く（bot側が合法手だけ呼ぶこと）"""
-        self.board[y][x] = who
+        self._put(x, y, who)
         self.last_move = (x, y)
 
-        if who == X:
-            if self._is_exact_five_from(x, y, who=X):
-                self.finished = True
-                self.winner = X
-                return
-        else:
-            if self._is_five_or_more_from(x, y, who=O):
-                self.finished = True
-                self.winner = O
-                return
-
-        if self._is_draw():
+        if who == X and self._is_exact_five_from(x, y, who=X):
+            self.finished = True
+            self.winner = X
+        elif who == O and self._is_five_or_more_from(x, y, who=O):
+            self.finished = True
+            self.winner = O
+        elif self._is_draw():
             self.finished = True
             self.winner = None
-            return
+        else:
+            self.turn = O if who == X else X
+
+        # 描画スレッドは move_count をキーに PNG を覚えるので、盤面・手番・勝敗を揃えてから最後に上げる
+        self.move_count += 1
+
+    def _put(self, x: int, y: int, who: int) -> None:
+        i = y * self.size + x
+        self.board[i] = who
+        self._flip_bits(i, who)
+        self._flip_bits(i, EMPTY)
+        self.empty_count -= 1
+        self.hash ^= self._zobrist[y][x][who]
+        self.stones.add((x, y))
+        near = self._near
+        for cell, delta in self._near_cells[y][x]:
+            near[cell] = near.get(cell, 0) + delta
+
+    def _remove(self, x: int, y: int) -> None:
+        i = y * self.size + x
+        who = self.board[i]
+        self.hash ^= self._zobrist[y][x][who]
+        self._flip_bits(i, who)
+        self._flip_bits(i, EMPTY)
+        self.empty_count += 1
+        self.board[i] = EMPTY
+        self.stones.discard((x, y))
+        near = self._near
+        for cell, delta in self._near_cells[y][x]:
+            v = near[cell] - delta
+            if v:
+                near[cell] = v
+            else:
+                del near[cell]
+
+    def _flip_bits(self, i: int, who: int) -> None:
+        """who のビットボードのマス i を反転（置く/取るの両方に使う）"""
+        bb = self.bb[who]
+        sh, sv, sd, sa = self._bit_shifts[i]
+        bb[0] ^= 32 << sh
+        bb[1] ^= 32 << sv
+        bb[2] ^= 32 << sd
+        bb[3] ^= 32 << sa
+
+    def _near_empties(self, radius: int) -> List[Tuple[int, int]]:
+        """石から radius 以内にある空きマス"""
+        board = self.board
+        n = self.size
+        if radius <= _NEAR_RADII:
+            shift = 8 * (radius - 1)
+            return [(x, y) for (x, y), v in self._near.items() if v >> shift & 0xFF and board[y * n + x] == EMPTY]
 
-        self.turn = O if who == X else X
+        out: Set[Tuple[int, int]] = set()
+        for sx, sy in self.stones:
+            for dy in range(-radius, radius + 1):
+                ny = sy + dy
+                if not 0 <= ny < n:
+                    continue
+                for dx in range(-radius, radius + 1):
+                    nx = sx + dx
+                    if 0 <= nx < n and board[ny * n + nx] == EMPTY:
+                        out.add((nx, ny))
+        return list(out)
 
     def _is_draw(self) -> bool:
-        return all(self.board[yy][xx] != EMPTY for yy in range(self.size) for xx in range(self.size))
+        return self.empty_count == 0
 
     # ---------------- rules (Renju-like for X only) ----------------
     # 先手(X)のみ禁じ手: 33/44/長連（6以上）
     # 勝ち: Xは「ちょうど5」、Oは「5以上」
 
     def _place_with_rules(self, x: int, y: int, who: int) -> Tuple[bool, str]:
-        self.board[y][x] = who
-        self.last_move = (x, y)
-
-        if who == O:
-            if self._is_five_or_more_from(x, y, who=O):
-                self.finished = True
-                self.winner = O
-                return True, "勝敗が決まりました。"
-            if self._is_draw():
-                self.finished = True
-                self.winner = None
-                return True, "勝敗が決まりました。"
-            self.turn = X
-            return True, "OK"
-
-        # who == X (forbidden)
-        if self._creates_overline(x, y, who=X):
-            self.board[y][x] = EMPTY
-            self.last_move = None
-            return False, "禁じ手: 長連（6以上）が発生します。"
-
-        # ちょうど5なら勝ち（禁じ手より勝ちを優先）
-        if self._is_exact_five_from(x, y, who=X):
-            self.finished = True
-            self.winner = X
-            return True, "勝敗が決まりました。"
-
-        if self._is_forbidden_44(x, y):
-            self.board[y][x] = EMPTY
-            self.last_move = None
-            return False, "禁じ手: 四四（同時に2つ以上の四の筋）が発生します。"
-
-        if self._is_forbidden_33(x, y):
-            self.board[y][x] = EMPTY
-            self.last_move = None
-            return False, "禁じ手: 三三（同時に2つ以上の両開き三）が発生します。"
-
-        if self._is_draw():
-            self.finished = True
-            self.winner = None
+        if who == X:
+            # 禁じ手の判定は複製した盤面で行う（描画スレッドから読まれる盤面に、弾く石を一瞬でも置かない）
+            trial = self._snapshot()
+            trial._put(x, y, X)
+            if trial._creates_overline(x, y, who=X):
+                return False, "禁じ手: 長連（6以上）が発生します。"
+            # ちょうど5なら勝ち（禁じ手より勝ちを優先）
+            if not trial._is_exact_five_from(x, y, who=X):
+                if trial._is_forbidden_44(x, y):
+                    return False, "禁じ手: 四四（同時に2つ以上の四の筋）が発生します。"
+                if trial._is_forbidden_33(x, y):
+                    return False, "禁じ手: 三三（同時に2つ以上の両開き三）が発生します。"
+
+        self._place_raw(x, y, who)
+        if self.finished:
             return True, "勝敗が決まりました。"
-
-        self.turn = O
         return True, "OK"
 
-    # ---------------- win checks ----------------
+    def _runs_if_put(self, x: int, y: int, who: int) -> Tuple[int, int, int, int]:
+        return self._runs_at(y * self.size + x, who)
 
-    def _count_one_dir(self, x: int, y: int, dx: int, dy: int, who: int) -> int:
-        cnt = 0
-        cx, cy = x + dx, y + dy
-        while _inside(self.size, cx, cy) and self.board[cy][cx] == who:
-            cnt += 1
-            cx += dx
-            cy += dy
-        return cnt
-
-    def _max_run_in_dir(self, x: int, y: int, dx: int, dy: int, who: int) -> int:
-        return 1 + self._count_one_dir(x, y, dx, dy, who) + self._count_one_dir(x, y, -dx, -dy, who)
+    def _runs_at(self, i: int, who: int) -> Tuple[int, int, int, int]:
+        """
+        マス i に who がある（置いたと仮定した）ときの、4方向それぞれの連の長さ。
+        盤面は触らず、方向毎のビットボードから前後5マスの窓を切り出して表を引く。
+        """
+        bh, bv, bd, ba = self.bb[who]
+        sh, sv, sd, sa = self._bit_shifts[i]
+        run = _RUN_LEN
+        return (
+            run[(bh >> sh | 32) & 0x7FF],
+            run[(bv >> sv | 32) & 0x7FF],
+            run[(bd >> sd | 32) & 0x7FF],
+            run[(ba >> sa | 32) & 0x7FF],
+        )
 
     def _is_five_or_more_from(self, x: int, y: int, who: int) -> bool:
-        for dx, dy in [(1, 0), (0, 1), (1, 1), (1, -1)]:
-            if self._max_run_in_dir(x, y, dx, dy, who) >= 5:
-                return True
-        return False
+        return max(self._runs_if_put(x, y, who)) >= 5
 
     def _is_exact_five_from(self, x: int, y: int, who: int) -> bool:
-        for dx, dy in [(1, 0), (0, 1), (1, 1), (1, -1)]:
-            if self._max_run_in_dir(x, y, dx, dy, who) == 5:
-                return True
-        return False
+        return 5 in self._runs_if_put(x, y, who)
 
     def _creates_overline(self, x: int, y: int, who: int) -> bool:
-        for dx, dy in [(1, 0), (0, 1), (1, 1), (1, -1)]:
-            if self._max_run_in_dir(x, y, dx, dy, who) >= 6:
-                return True
-        return False
+        return max(self._runs_if_put(x, y, who)) >= 6
 
     # ---------------- forbidden detection (practical approximation) ----------------
 
-    def _line_string(self, x: int, y: int, dx: int, dy: int, span: int = 6) -> Tuple[str, int]:
-        chars = []
-        for k in range(-span, span + 1):
-            cx, cy = x + dx * k, y + dy * k
-            if not _inside(self.size, cx, cy):
-                chars.append("#")
-            else:
-                v = self.board[cy][cx]
-                if v == EMPTY:
-                    chars.append(".")
-                elif v == X:
-                    chars.append("X")
-                else:
-                    chars.append("O")
-        return "".join(chars), span
-
-    def _has_open_three_in_dir_involving_center(self, x: int, y: int, dx: int, dy: int) -> bool:
-        line, c = self._line_string(x, y, dx, dy, span=6)
-        patterns = [
-            ".XXX.",
-            ".XX.X.",
-            ".X.XX.",
-        ]
-        for p in patterns:
-            start = 0
-            while True:
-                idx = line.find(p, start)
-                if idx == -1:
-                    break
-                end = idx + len(p)
-                if idx <= c < end and "#" not in line[idx:end]:
-                    return True
-                start = idx + 1
+    def _has_open_three_in_dir_involving_center(self, x: int, y: int, d: int) -> bool:
+        """
+        d 方向（_DIRS の添字）で、(x,y) を含む両開き三があるか。
+        黒石と空きマスの前後5マスの窓をビットボードから切り出し、表の形と突き合わせる。
+        """
+        sh = self._bit_shifts[y * self.size + x][d]
+        stones = self.bb[X][d] >> sh & 0x7FF
+        empty = self.bb[EMPTY][d] >> sh & 0x7FF
+        for need_empty in _OPEN_THREE_EMPTIES[stones]:
+            if empty & need_empty == need_empty:
+                return True
         return False
 
-    def _winning_cells_in_dir_for_x(self, x: int, y: int, dx: int, dy: int) -> int:
-        candidates: List[Tuple[int, int]] = []
-        for k in range(-5, 6):
-            cx, cy = x + dx * k, y + dy * k
-            if _inside(self.size, cx, cy) and self.board[cy][cx] == EMPTY:
-                candidates.append((cx, cy))
-
+    def _winning_cells_in_dir_for_x(self, x: int, y: int, d: int) -> int:
+        """d 方向（_DIRS の添字）の前後5マスで、X が置けば勝てる空点の数"""
+        board = self.board
+        rays = self._rays[y * self.size + x]
         cnt = 0
-        for cx, cy in candidates:
-            self.board[cy][cx] = X
-            is_win = self._is_exact_five_from(cx, cy, who=X) and (not self._creates_overline(cx, cy, who=X))
-            self.board[cy][cx] = EMPTY
-            if is_win:
-                cnt += 1
+        for ray in (rays[d], rays[d + 4]):
+            for i in ray[:5]:
+                if board[i] == EMPTY and self._is_win_at(i, X):
+                    cnt += 1
         return cnt
 
     def _is_forbidden_44(self, x: int, y: int) -> bool:
         four_dirs = 0
-        for dx, dy in [(1, 0), (0, 1), (1, 1), (1, -1)]:
-            if self._winning_cells_in_dir_for_x(x, y, dx, dy) >= 1:
+        for d in range(4):
+            if self._winning_cells_in_dir_for_x(x, y, d) >= 1:
                 four_dirs += 1
         return four_dirs >= 2
 
     def _is_forbidden_33(self, x: int, y: int) -> bool:
         three_dirs = 0
-        for dx, dy in [(1, 0), (0, 1), (1, 1), (1, -1)]:
-            if self._has_open_three_in_dir_involving_center(x, y, dx, dy):
+        for d in range(4):
+            if self._has_open_three_in_dir_involving_center(x, y, d):
                 three_dirs += 1
         return three_dirs >= 2
 
     def is_legal_move(self, x: int, y: int, who: int) -> bool:
         """AI探索用：その手が合法か（禁じ手込み）"""
-        if not _inside(self.size, x, y):
+        n = self.size
+        if not (0 <= x < n and 0 <= y < n):
             return False
-        if self.board[y][x] != EMPTY:
+        i = y * n + x
+        board = self.board
+        if board[i] != EMPTY:
             return False
 
-        self.board[y][x] = who
-        ok = True
+        if who != X:
+            return True
 
-        if who == X:
-            if self._creates_overline(x, y, who=X):
-                ok = False
-            elif self._is_forbidden_44(x, y):
-                ok = False
-            elif self._is_forbidden_33(x, y):
-                ok = False
-
-        self.board[y][x] = EMPTY
+        # 禁じ手判定は盤面とビットボードしか見ないので、その2つだけ仮置きする
+        board[i] = X
+        self._flip_bits(i, X)
+        self._flip_bits(i, EMPTY)
+        ok = True
+        if self._creates_overline(x, y, who=X):
+            ok = False
+        elif self._is_forbidden_44(x, y):
+            ok = False
+        elif self._is_forbidden_33(x, y):
+            ok = False
+        self._flip_bits(i, X)
+        self._flip_bits(i, EMPTY)
+        board[i] = EMPTY
         return ok
 
     # ---------------- AI (Route B) ----------------
 
     def ai_move(self) -> Tuple[int, int]:
-        """AIの番（player_id が None の側）で呼ぶ。戻り値は0-index(x,y)"""
+        """
+        AIの番（player_id が None の側）で呼ぶ。戻り値は0-index(x,y)
+        bot側からは asyncio.to_thread 経由で呼ばれるので、探索は複製した盤面で行う
+        （探索中の仮置きが描画などに見えないようにする）。
+        """
         if not self.is_ai_turn():
-            raise RuntimeError("ai_move called but it's not AI turn")
+            raise NotAITurnError("ai_move called but it's not AI turn")
 
+        search = self._snapshot()
         lvl = (self.ai_level or "easy").lower()
         who = self.turn
         if lvl == "hard":
             # ここを上げると強くなるが重くなる
-            return self._ai_move_hard(who, depth=2, radius=2, candidate_limit=40)
+            return search._ai_move_hard(
+                who, depth=2, radius=2, candidate_limit=40, time_budget_ms=_HARD_TIME_BUDGET_MS
+            )
         if lvl == "normal":
-            return self._ai_move_normal(who)
-        return self._ai_move_easy(who)
+            return search._ai_move_normal(who)
+        return search._ai_move_easy(who)
+
+    def _snapshot(self) -> GomokuGame:
+        """探索用の複製（盤面だけ深くコピーする）"""
+        g = GomokuGame(
+            size=self.size,
+            mode=self.mode,
+            player_x=self.player_x,
+            player_o=self.player_o,
+            ai_level=self.ai_level,
+            turn=self.turn,
+            finished=self.finished,
+            winner=self.winner,
+            last_move=self.last_move,
+        )
+        g.board = bytearray(self.board)
+        g.bb = [list(b) for b in self.bb]
+        g.empty_count = self.empty_count
+        g.stones = set(self.stones)
+        g._near = dict(self._near)
+        g.hash = self.hash
+        g._tt = self._tt
+        g._eval_cache = self._eval_cache
+        g._rng = self._rng
+        return g
 
     def _opponent(self, who: int) -> int:
         return O if who == X else X
 
     def _is_win_if_put(self, x: int, y: int, who: int) -> bool:
-        self.board[y][x] = who
-        win = False
+        return self._is_win_at(y * self.size + x, who)
+
+    def _is_win_at(self, i: int, who: int) -> bool:
+        runs = self._runs_at(i, who)
         if who == X:
-            win = self._is_exact_five_from(x, y, who=X) and (not self._creates_overline(x, y, who=X))
-        else:
-            win = self._is_five_or_more_from(x, y, who=O)
-        self.board[y][x] = EMPTY
-        return win
+            return 5 in runs and max(runs) < 6
+        return max(runs) >= 5
 
     # ---- immediate win / block ----
 
+    # 勝ち手（五を作る手）は必ず石の隣なので、半径1の空点だけ見ればよい。
+    # 勝ち判定はビットボードで軽いので、重い禁じ手判定より先にする。
+
+    def _win_cells_in_order(self) -> List[Tuple[int, int]]:
+        """勝ち手になりうる空点（石の隣）を、盤を左上から走査したのと同じ順に"""
+        return sorted(self._near_empties(1), key=lambda m: (m[1], m[0]))
+
     def _find_immediate_win(self, who: int) -> Optional[Tuple[int, int]]:
-        for y in range(self.size):
-            for x in range(self.size):
-                if self.board[y][x] != EMPTY:
-                    continue
-                if who == X and not self.is_legal_move(x, y, X):
-                    continue
-                if self._is_win_if_put(x, y, who):
-                    return (x, y)
+        for x, y in self._win_cells_in_order():
+            if not self._is_win_if_put(x, y, who):
+                continue
+            if who == X and not self.is_legal_move(x, y, X):
+                continue
+            return (x, y)
         return None
 
     def _find_immediate_block(self, who: int) -> Optional[Tuple[int, int]]:
         """相手の即勝ちを塞ぐ（相手がその手を合法に打てる場合のみ脅威扱い）"""
         opp = self._opponent(who)
-        for y in range(self.size):
-            for x in range(self.size):
-                if self.board[y][x] != EMPTY:
-                    continue
-                if opp == X and not self.is_legal_move(x, y, X):
-                    continue
-                if self._is_win_if_put(x, y, opp):
-                    if who == X and not self.is_legal_move(x, y, X):
-                        continue
-                    return (x, y)
+        for x, y in self._win_cells_in_order():
+            if not self._is_win_if_put(x, y, opp):
+                continue
+            if opp == X and not self.is_legal_move(x, y, X):
+                continue
+            if who == X and not self.is_legal_move(x, y, X):
+                continue
+            return (x, y)
         return None
 
     # ---- fork (four+three etc) detection: "after 1 move, next has >=2 immediate wins" ----
@@ -335,22 +605,12 @@ class GomokuGame:
         fork判定など、少し広めに候補を集めたいとき用。
         盤上の石の周辺（radius）+ 空点のみ。
         """
-        n = self.size
-        stones = [(x, y) for y in range(n) for x in range(n) if self.board[y][x] != EMPTY]
-        if not stones:
-            c = n // 2
+        if not self.stones:
+            c = self.size // 2
             return [(c, c)]
 
-        cand: Set[Tuple[int, int]] = set()
-        for sx, sy in stones:
-            for dy in range(-radius, radius + 1):
-                for dx in range(-radius, radius + 1):
-                    nx, ny = sx + dx, sy + dy
-                    if _inside(n, nx, ny) and self.board[ny][nx] == EMPTY:
-                        cand.add((nx, ny))
-
         out: List[Tuple[int, int]] = []
-        for x, y in cand:
+        for x, y in self._near_empties(radius):
             if who == X and not self.is_legal_move(x, y, X):
                 continue
             out.append((x, y))
@@ -361,30 +621,28 @@ class GomokuGame:
         現局面で、who が次の1手で勝てる手の個数（早期打ち切りあり）
         """
         cnt = 0
-        for y in range(self.size):
-            for x in range(self.size):
-                if self.board[y][x] != EMPTY:
-                    continue
-                if who == X and not self.is_legal_move(x, y, X):
-                    continue
-                if self._is_win_if_put(x, y, who):
-                    cnt += 1
-                    if cnt >= early_stop:
-                        return cnt
+        for x, y in self._near_empties(1):
+            if not self._is_win_if_put(x, y, who):
+                continue
+            if who == X and not self.is_legal_move(x, y, X):
+                continue
+            cnt += 1
+            if cnt >= early_stop:
+                return cnt
         return cnt
 
     def _is_fork_move(self, x: int, y: int, who: int) -> bool:
         """
         who が (x,y) に打つと、次に who の即勝ち手が2つ以上生えるか？
         """
-        if self.board[y][x] != EMPTY:
+        if self.board[y * self.size + x] != EMPTY:
             return False
         if who == X and not self.is_legal_move(x, y, X):
             return False
 
-        self.board[y][x] = who
+        self._put(x, y, who)
         ok = self._count_immediate_wins(who, early_stop=2) >= 2
-        self.board[y][x] = EMPTY
+        self._remove(x, y)
         return ok
 
     def _find_fork_moves(self, who: int) -> List[Tuple[int, int]]:
@@ -411,7 +669,7 @@ class GomokuGame:
         best = None
         best_s = -(10**18)
         for x, y in forks:
-            if self.board[y][x] != EMPTY:
+            if self.board[y * self.size + x] != EMPTY:
                 continue
             if who == X and not self.is_legal_move(x, y, X):
                 continue
@@ -421,6 +679,94 @@ class GomokuGame:
                 best = (x, y)
         return best
 
+    # ---- threat-space search (VCF: 四を打ち続けて勝つ) ----
+
+    def _win_points_through(self, x: int, y: int, who: int) -> List[Tuple[int, int]]:
+        """(x,y) を通る4方向の線上で、who が次に置けば勝てる空点"""
+        n = self.size
+        board = self.board
+        rays = self._rays[y * n + x]
+        out: List[Tuple[int, int]] = []
+        for d in range(4):
+            # 逆向きの遠い方から順に（-4..-1, 1..4）
+            for i in rays[d + 4][3::-1] + rays[d][:4]:
+                if board[i] != EMPTY or not self._is_win_at(i, who):
+                    continue
+                cy, cx = divmod(i, n)
+                if (cx, cy) in out:
+                    continue
+                if who == X and not self.is_legal_move(cx, cy, X):
+                    continue
+                out.append((cx, cy))
+        return out
+
+    def _may_make_four(self, x: int, y: int, who: int) -> bool:
+        """どれかの方向で、(x,y) の前後4マスに who の石が3つ以上あるか（四の必要条件）"""
+        board = self.board
+        rays = self._rays[y * self.size + x]
+        for d in range(4):
+            cnt = 0
+            for ray in (rays[d], rays[d + 4]):
+                for i in ray[:4]:
+                    if board[i] == who:
+                        cnt += 1
+            if cnt >= 3:
+                return True
+        return False
+
+    def _find_vcf(self, who: int, *, depth: int) -> Optional[Tuple[int, int]]:
+        """
+        四を打ち続けて（相手は止めるしかない）勝ち切れるなら最初の手を返す。
+        - 四が2つ同時にできれば勝ち
+        - 相手の止める手が禁じ手（相手がX）なら勝ち
+        - 相手の止めた手で相手に勝ち筋ができるなら、その順は読まない
+        """
+        if depth <= 0:
+            return None
+
+        n = self.size
+        board = self.board
+        opp = self._opponent(who)
+        # 盤面は舐めず、石の一覧から who の石だけを見る
+        cand: Set[Tuple[int, int]] = set()
+        for sx, sy in self.stones:
+            if board[sy * n + sx] != who:
+                continue
+            for dy in range(-2, 3):
+                ny = sy + dy
+                if not 0 <= ny < n:
+                    continue
+                for dx in range(-2, 3):
+                    nx = sx + dx
+                    if 0 <= nx < n and board[ny * n + nx] == EMPTY:
+                        cand.add((nx, ny))
+
+        for x, y in cand:
+            if not self._may_make_four(x, y, who):
+                continue
+            if who == X and not self.is_legal_move(x, y, X):
+                continue
+
+            self._put(x, y, who)
+            wins = self._win_points_through(x, y, who)
+            ok = False
+            if len(wins) >= 2:
+                ok = True
+            elif len(wins) == 1:
+                bx, by = wins[0]
+                if opp == X and not self.is_legal_move(bx, by, X):
+                    ok = True
+                else:
+                    self._put(bx, by, opp)
+                    if not self._is_five_for(bx, by, opp) and not self._win_points_through(bx, by, opp):
+                        ok = self._find_vcf(who, depth=depth - 1) is not None
+                    self._remove(bx, by)
+            self._remove(x, y)
+
+            if ok:
+                return (x, y)
+        return None
+
     # ---- move candidates & eval ----
 
     def _candidate_moves_near(
@@ -438,8 +784,7 @@ class GomokuGame:
         - forced（防御必須など）は limit で落とさない
         """
         n = self.size
-        stones = [(x, y) for y in range(n) for x in range(n) if self.board[y][x] != EMPTY]
-        if not stones:
+        if not self.stones:
             c = n // 2
             return [(c, c)]
 
@@ -447,18 +792,13 @@ class GomokuGame:
 
         # forced を先に入れる
         for fx, fy in forced:
-            if _inside(n, fx, fy) and self.board[fy][fx] == EMPTY:
+            if 0 <= fx < n and 0 <= fy < n and self.board[fy * n + fx] == EMPTY:
                 if who == X and not self.is_legal_move(fx, fy, X):
                     continue
                 cand.add((fx, fy))
 
         # 近傍
-        for sx, sy in stones:
-            for dy in range(-radius, radius + 1):
-                for dx in range(-radius, radius + 1):
-                    nx, ny = sx + dx, sy + dy
-                    if _inside(n, nx, ny) and self.board[ny][nx] == EMPTY:
-                        cand.add((nx, ny))
+        cand.update(self._near_empties(radius))
 
         legal: List[Tuple[int, int]] = []
         for x, y in cand:
@@ -476,45 +816,14 @@ class GomokuGame:
 
         scored = [(self._eval_move(x, y, who), x, y) for (x, y) in rest]
         scored.sort(key=lambda t: t[0], reverse=True)
+        # must_keep と rest は同じ集合を分けたものなので重複しない
         top = scored[: max(0, limit - len(must_keep))]
-        merged = must_keep + [(x, y) for _, x, y in top]
-
-        # 念のため重複除去
-        out: List[Tuple[int, int]] = []
-        seen = set()
-        for m in merged:
-            if m not in seen:
-                out.append(m)
-                seen.add(m)
-        return out
-
-    def _line_features_if_put(self, x: int, y: int, who: int, dx: int, dy: int) -> Tuple[int, int]:
-        """
-        (x,y)にwhoを置いたと仮定したとき、その方向の
-        - 連の長さ
-        - open ends（0/1/2）
-        を返す
-        """
-        n = self.size
-
-        def walk(stepx, stepy):
-            cnt = 0
-            cx, cy = x + stepx, y + stepy
-            while _inside(n, cx, cy) and self.board[cy][cx] == who:
-                cnt += 1
-                cx += stepx
-                cy += stepy
-            open_end = 1 if (_inside(n, cx, cy) and self.board[cy][cx] == EMPTY) else 0
-            return cnt, open_end
-
-        c1, o1 = walk(dx, dy)
-        c2, o2 = walk(-dx, -dy)
-        length = 1 + c1 + c2
-        return length, (o1 + o2)
+        must_keep.extend((x, y) for _, x, y in top)
+        return must_keep
 
     def _eval_move(self, x: int, y: int, who: int) -> int:
         """候補手の静的評価（Route B用のベース）"""
-        if self.board[y][x] != EMPTY:
+        if self.board[y * self.size + x] != EMPTY:
             return -10**9
         if who == X and not self.is_legal_move(x, y, X):
             return -10**9
@@ -527,36 +836,36 @@ class GomokuGame:
         if (opp == X and self.is_legal_move(x, y, X) or opp == O) and self._is_win_if_put(x, y, opp):
             return 9 * 10**7
 
-        dirs = [(1, 0), (0, 1), (1, 1), (1, -1)]
-
-        def score_for(p: int) -> int:
-            s = 0
-            for dx, dy in dirs:
-                length, open_ends = self._line_features_if_put(x, y, p, dx, dy)
-
-                if p == O:
-                    if length >= 5:
-                        s += 1_000_000
-                    elif length == 4:
-                        s += 120_000 if open_ends == 2 else (30_000 if open_ends == 1 else 0)
-                    elif length == 3:
-                        s += 12_000 if open_ends == 2 else (3_000 if open_ends == 1 else 0)
-                    elif length == 2:
-                        s += 1_200 if open_ends == 2 else (300 if open_ends == 1 else 0)
-                else:
-                    if length >= 5:
-                        s += 800_000
-                    elif length == 4:
-                        s += 110_000 if open_ends == 2 else (25_000 if open_ends == 1 else 0)
-                    elif length == 3:
-                        s += 11_000 if open_ends == 2 else (2_500 if open_ends == 1 else 0)
-                    elif length == 2:
-                        s += 1_000 if open_ends == 2 else (250 if open_ends == 1 else 0)
-            return s
-
-        attack = score_for(who)
-        defense = score_for(opp)
+        attack, defense = self._shape_scores(x, y, who)
+        return self._combine_scores(x, y, attack, defense)
 
+    def _shape_scores(self, x: int, y: int, who: int) -> Tuple[int, int]:
+        """攻め（(x,y) を who の石としたときの形の点数）と守り（相手の石としたときの点数）を同じループで数える"""
+        opp = self._opponent(who)
+        mine = _LINE_SCORE[who]
+        theirs = _LINE_SCORE[opp]
+        bb_who = self.bb[who]
+        bb_opp = self.bb[opp]
+        bb_empty = self.bb[EMPTY]
+        shifts = self._bit_shifts[y * self.size + x]
+        attack = 0
+        defense = 0
+        for d in range(4):
+            # 窓の bit 4/6 = その方向の両隣。両隣に石がなければ連の長さは1で0点なので、表も引かない
+            sh = shifts[d]
+            pat = bb_who[d] >> sh & 0x7FF
+            if pat & 0x50:
+                pat |= 32
+                length = _RUN_LEN[pat]
+                attack += mine[min(length, 5)][_POPCOUNT[_RUN_ENDS[pat] & bb_empty[d] >> sh]]
+            pat = bb_opp[d] >> sh & 0x7FF
+            if pat & 0x50:
+                pat |= 32
+                length = _RUN_LEN[pat]
+                defense += theirs[min(length, 5)][_POPCOUNT[_RUN_ENDS[pat] & bb_empty[d] >> sh]]
+        return attack, defense
+
+    def _combine_scores(self, x: int, y: int, attack: int, defense: int) -> int:
         # 中央寄せ（序盤）
         cx = cy = (self.size - 1) / 2.0
         dist = abs(x - cx) + abs(y - cy)
@@ -565,34 +874,57 @@ class GomokuGame:
         return attack + int(defense * 0.95) + center_bonus
 
     def _static_eval_board(self, who: int) -> int:
-        """盤面全体評価（探索の葉）"""
+        """盤面全体評価（探索の葉）。同じ局面は _eval_cache から返す"""
+        key = (self.hash, who)
+        val = self._eval_cache.get(key)
+        if val is None:
+            if len(self._eval_cache) >= _EVAL_CACHE_SIZE:
+                self._eval_cache.clear()
+            val = self._eval_cache[key] = self._static_eval_board_uncached(who)
+        return val
+
+    def _static_eval_board_uncached(self, who: int) -> int:
         n = self.size
-        near = set()
-        for y in range(n):
-            for x in range(n):
-                if self.board[y][x] == EMPTY:
-                    continue
-                for dy in (-1, 0, 1):
-                    for dx in (-1, 0, 1):
-                        nx, ny = x + dx, y + dy
-                        if _inside(n, nx, ny) and self.board[ny][nx] == EMPTY:
-                            near.add((nx, ny))
+        near = self._near_empties(1)
 
         if not near:
             c = n // 2
-            return 0 if (self.board[c][c] != EMPTY) else 50
+            return 0 if (self.board[c * n + c] != EMPTY) else 50
 
+        # 1マスにつき禁じ手判定・勝ち判定・形の点数を一度ずつだけ求め、
+        # who と opp の両方の _eval_move 相当の値をそこから作る（結果は _eval_move を2回呼ぶのと同じ）
         opp = self._opponent(who)
         best_who = -(10**18)
         best_opp = -(10**18)
         for x, y in near:
-            if who == X and not self.is_legal_move(x, y, X):
-                continue
-            best_who = max(best_who, self._eval_move(x, y, who))
-        for x, y in near:
-            if opp == X and not self.is_legal_move(x, y, X):
-                continue
-            best_opp = max(best_opp, self._eval_move(x, y, opp))
+            legal_x = self.is_legal_move(x, y, X)
+            who_ok = who == O or legal_x
+            opp_ok = opp == O or legal_x
+            win_who = self._is_win_if_put(x, y, who)
+            win_opp = self._is_win_if_put(x, y, opp)
+            shapes = None  # (who の形の点数, opp の形の点数)。要るときだけ数える
+
+            if who_ok:
+                if win_who:
+                    v = 10**8
+                elif opp_ok and win_opp:
+                    v = 9 * 10**7
+                else:
+                    shapes = self._shape_scores(x, y, who)
+                    v = self._combine_scores(x, y, shapes[0], shapes[1])
+                if v > best_who:
+                    best_who = v
+            if opp_ok:
+                if win_opp:
+                    v = 10**8
+                elif who_ok and win_who:
+                    v = 9 * 10**7
+                else:
+                    if shapes is None:
+                        shapes = self._shape_scores(x, y, who)
+                    v = self._combine_scores(x, y, shapes[1], shapes[0])
+                if v > best_opp:
+                    best_opp = v
         return int(best_who - best_opp * 0.92)
 
     # ---------------- AI levels ----------------
@@ -606,7 +938,7 @@ class GomokuGame:
             return block
 
         moves = self._candidate_moves_near(radius=2, limit=18, who=who)
-        return random.choice(moves) if moves else (self.size // 2, self.size // 2)
+        return moves[self._rng.randrange(len(moves))] if moves else (self.size // 2, self.size // 2)
 
     def _ai_move_normal(self, who: int) -> Tuple[int, int]:
         win = self._find_immediate_win(who)
@@ -628,17 +960,26 @@ class GomokuGame:
         scored = [(self._eval_move(x, y, who), x, y) for (x, y) in moves]
         scored.sort(key=lambda t: t[0], reverse=True)
         top = scored[: min(6, len(scored))]
-        _, x, y = random.choice(top)
+        _, x, y = top[self._rng.randrange(len(top))]
         return (x, y)
 
-    def _ai_move_hard(self, who: int, *, depth: int, radius: int, candidate_limit: int) -> Tuple[int, int]:
+    def _ai_move_hard(
+        self,
+        who: int,
+        *,
+        depth: int,
+        radius: int,
+        candidate_limit: int,
+        time_budget_ms: Optional[int] = None,
+    ) -> Tuple[int, int]:
         """
         hard:
         1) 即勝ち
         2) 即負けブロック
-        3) fork（四三などの「次に勝ち手が2つ以上」）ブロック
-        4) 自分のforkがあれば作る
-        5) alpha-beta
+        3) 連続四（VCF）で勝てるならそれ
+        4) fork（四三などの「次に勝ち手が2つ以上」）ブロック
+        5) 自分のforkがあれば作る
+        6) alpha-beta
         """
         opp = self._opponent(who)
 
@@ -650,6 +991,11 @@ class GomokuGame:
         if block:
             return block
 
+        # 連続四（VCF）で勝ち切れるなら alpha-beta は不要
+        vcf = self._find_vcf(who, depth=7)
+        if vcf:
+            return vcf
+
         # ここが今回の「決定的な弱さ」を潰す核
         fork_block = self._find_fork_block(who)
         if fork_block:
@@ -666,95 +1012,218 @@ class GomokuGame:
         forced: List[Tuple[int, int]] = []
 
         # 相手の即勝ち点（複数ある場合）を forced に入れて、候補落ちを防ぐ
-        for y in range(self.size):
-            for x in range(self.size):
-                if self.board[y][x] != EMPTY:
-                    continue
-                if opp == X and not self.is_legal_move(x, y, X):
-                    continue
-                if self._is_win_if_put(x, y, opp):
-                    forced.append((x, y))
+        for x, y in self._win_cells_in_order():
+            if not self._is_win_if_put(x, y, opp):
+                continue
+            if opp == X and not self.is_legal_move(x, y, X):
+                continue
+            forced.append((x, y))
 
         moves = self._candidate_moves_near(radius=radius, limit=candidate_limit, who=who, forced=forced)
         if not moves:
             return self._ai_move_normal(who)
 
-        def negamax(turn: int, d: int, alpha: int, beta: int) -> int:
-            if self.finished:
-                if self.winner == who:
-                    return 10**9
-                if self.winner == opp:
-                    return -(10**9)
-                return 0
-
-            if d == 0:
-                return self._static_eval_board(who)
-
-            cand = self._candidate_moves_near(radius=radius, limit=candidate_limit, who=turn)
-            if not cand:
-                return 0
-
-            best = -(10**18)
-            for mx, my in cand:
-                self.board[my][mx] = turn
-                prev_last = self.last_move
-                self.last_move = (mx, my)
-
-                ended = False
-                prev_finished = self.finished
-                prev_winner = self.winner
-
-                if turn == X:
-                    if self._is_exact_five_from(mx, my, who=X):
-                        self.finished = True
-                        self.winner = X
-                        ended = True
-                else:
-                    if self._is_five_or_more_from(mx, my, who=O):
-                        self.finished = True
-                        self.winner = O
-                        ended = True
-
-                if ended:
-                    val = 10**9 if turn == who else -(10**9)
-                else:
-                    val = -negamax(self._opponent(turn), d - 1, -beta, -alpha)
-
-                self.board[my][mx] = EMPTY
-                self.last_move = prev_last
-                self.finished = prev_finished
-                self.winner = prev_winner
+        # 反復深化: 浅い深さの最善手（PV）を次の深さで最初に読む。
+        # 2回目からは前の評価値の周りの狭い窓（aspiration window）で読み、外れたら全幅で読み直す。
+        # time_budget_ms を超えたら、読み終えた深さの最善手を返す。
+        self._killers = [[None, None] for _ in range(depth + 1)]
+        self._history = [[0 for _ in range(self.size)] for _ in range(self.size)]
 
-                if val > best:
-                    best = val
-                if best > alpha:
-                    alpha = best
-                if alpha >= beta:
-                    break
+        started = time.monotonic()
+        best_move = moves[0]
+        prev_val: Optional[int] = None
+        for d in range(1, depth + 1):
+            if prev_val is None:
+                best_move, val = self._search_root(who, moves, d, -_INF, _INF, radius=radius, candidate_limit=candidate_limit)
+            else:
+                lo = prev_val - _ASPIRATION
+                hi = prev_val + _ASPIRATION
+                best_move, val = self._search_root(who, moves, d, lo, hi, radius=radius, candidate_limit=candidate_limit)
+                if val <= lo or val >= hi:
+                    best_move, val = self._search_root(
+                        who, moves, d, -_INF, _INF, radius=radius, candidate_limit=candidate_limit
+                    )
+            prev_val = val
+            moves.remove(best_move)
+            moves.insert(0, best_move)
+            if time_budget_ms is not None and (time.monotonic() - started) * 1000 >= time_budget_ms:
+                break
+        return best_move
 
-            return int(best)
+    # ---------------- search (alpha-beta) ----------------
 
+    def _search_root(
+        self,
+        who: int,
+        moves: List[Tuple[int, int]],
+        depth: int,
+        alpha: int,
+        beta: int,
+        *,
+        radius: int,
+        candidate_limit: int,
+    ) -> Tuple[Tuple[int, int], int]:
+        """(最善手, 評価値)。評価値が alpha 以下/beta 以上なら、それは上限/下限でしかない"""
+        opp = self._opponent(who)
         best_move = moves[0]
-        best_val = -(10**18)
+        best = -_INF
 
         for x, y in moves:
-            self.board[y][x] = who
-            prev_last = self.last_move
-            self.last_move = (x, y)
+            self._put(x, y, who)
 
             # 即勝ち（念のため）
-            if (who == X and self._is_exact_five_from(x, y, who=X)) or (who == O and self._is_five_or_more_from(x, y, who=O)):
-                self.board[y][x] = EMPTY
-                self.last_move = prev_last
-                return (x, y)
-
-            val = -negamax(opp, depth - 1, -(10**18), 10**18)
+            if self._is_five_for(x, y, who):
+                self._remove(x, y)
+                return (x, y), _WIN
 
-            self.board[y][x] = EMPTY
-            self.last_move = prev_last
+            val = -self._alphabeta(opp, depth - 1, -beta, -alpha, 1, radius=radius, candidate_limit=candidate_limit)
+            self._remove(x, y)
 
-            if val > best_val:
-                best_val = val
+            if val > best:
+                best = val
                 best_move = (x, y)
+            if best > alpha:
+                alpha = best
+            if alpha >= beta:
+                break
 
-        return best_move
+        return best_move, best
+
+    def _alphabeta(
+        self,
+        turn: int,
+        depth: int,
+        alpha: int,
+        beta: int,
+        ply: int,
+        *,
+        radius: int,
+        candidate_limit: int,
+    ) -> int:
+        """negamax + alpha-beta。値は turn 側から見た評価"""
+        if depth == 0:
+            return self._static_eval_board(turn)
+
+        # 手番は石の数で決まるので、盤面の hash だけをキーにできる
+        key = self.hash
+        entry = self._tt.get(key)
+        tt_move = None
+        if entry is not None:
+            e_depth, e_val, e_flag, tt_move = entry
+            if e_depth >= depth:
+                if e_flag == _TT_EXACT:
+                    return e_val
+                if e_flag == _TT_LOWER and e_val >= beta:
+                    return e_val
+                if e_flag == _TT_UPPER and e_val <= alpha:
+                    return e_val
+
+        opp = self._opponent(turn)
+        alpha_orig = alpha
+        best = -_INF
+        best_move = None
+        futile = None  # 2手目以降を読むときに初めて判定する（1手目で cut されれば静的評価は要らない）
+        for i, (mx, my) in enumerate(self._node_moves(turn, ply, tt_move, radius=radius, candidate_limit=candidate_limit)):
+            if i > 0:
+                # futility pruning: 葉の直前で大きく負けているなら、四を作る/止める手以外は読まない
+                if futile is None:
+                    futile = depth == 1 and self._static_eval_board(turn) + _FUTILITY_MARGIN <= alpha_orig
+                if futile and self._eval_move(mx, my, turn) < _TACTICAL_SCORE:
+                    continue
+
+            self._put(mx, my, turn)
+            if self._is_five_for(mx, my, turn):
+                val = _WIN - ply
+            else:
+                val = -self._alphabeta(opp, depth - 1, -beta, -alpha, ply + 1, radius=radius, candidate_limit=candidate_limit)
+            self._remove(mx, my)
+
+            if val > best:
+                best = val
+                best_move = (mx, my)
+            if best > alpha:
+                alpha = best
+            if alpha >= beta:
+                self._store_killer(ply, (mx, my))
+                self._history[my][mx] += depth * depth
+                break
+
+        if best_move is None:
+            return 0
+
+        if best <= alpha_orig:
+            flag = _TT_UPPER
+        elif best >= beta:
+            flag = _TT_LOWER
+        else:
+            flag = _TT_EXACT
+        if len(self._tt) >= _TT_SIZE:
+            self._tt.clear()
+        self._tt[key] = (depth, int(best), flag, best_move)
+
+        return int(best)
+
+    def _node_moves(
+        self,
+        turn: int,
+        ply: int,
+        tt_move: Optional[Tuple[int, int]],
+        *,
+        radius: int,
+        candidate_limit: int,
+    ) -> Iterator[Tuple[int, int]]:
+        """
+        探索ノードで読む手を順に返す。置換表の最善手と killer を先に返し、
+        それで cut されなければ候補手の生成（全候補の _eval_move）まで進む。
+        """
+        staged: List[Tuple[int, int]] = []
+        if radius <= _NEAR_RADII:
+            shift = 8 * (radius - 1)
+            for m in (tt_move, *self._killers[ply]):
+                if m is None or m in staged:
+                    continue
+                x, y = m
+                if self.board[y * self.size + x] != EMPTY or not self._near.get(m, 0) >> shift & 0xFF:
+                    continue
+                if turn == X and not self.is_legal_move(x, y, X):
+                    continue
+                staged.append(m)
+                yield m
+
+        cand = self._candidate_moves_near(radius=radius, limit=candidate_limit, who=turn)
+        self._order_moves(cand, ply, tt_move)
+        for m in cand:
+            if m not in staged:
+                yield m
+
+    def _is_five_for(self, x: int, y: int, who: int) -> bool:
+        """(x,y) に who が置かれている前提で、その手が勝ちか"""
+        if who == X:
+            return self._is_exact_five_from(x, y, who=X)
+        return self._is_five_or_more_from(x, y, who=O)
+
+    def _order_moves(
+        self,
+        cand: List[Tuple[int, int]],
+        ply: int,
+        tt_move: Optional[Tuple[int, int]] = None,
+    ) -> None:
+        """
+        cand をその場で並べ替える（探索の各ノードで新しいリストを作らない）。
+        history 降順（同点は静的評価順のまま）+ killer を先頭に、置換表の最善手はさらにその前。
+        """
+        history = self._history
+        cand.sort(key=lambda m: history[m[1]][m[0]], reverse=True)
+        for k in reversed(self._killers[ply]):
+            if k is not None and k in cand:
+                cand.remove(k)
+                cand.insert(0, k)
+        if tt_move is not None and tt_move in cand:
+            cand.remove(tt_move)
+            cand.insert(0, tt_move)
+
+    def _store_killer(self, ply: int, move: Tuple[int, int]) -> None:
+        killers = self._killers[ply]
+        if killers[0] != move:
+            killers[1] = killers[0]
+            killers[0] = move
@@ -1,25 +1,30 @@
 from __future__ import annotations
 
+from functools import lru_cache
 from io import BytesIO
 from PIL import Image, ImageDraw, ImageFont
 
-from features.gomoku import EMPTY, X, O, GomokuGame
+from features.gomoku import X, O, GomokuGame
 
 
+_FONT_CANDIDATES = (
+    "arial.ttf",                 # Windowsでよくある
+    "meiryo.ttc",                # 日本語環境
+    "msgothic.ttc",              # 日本語環境
+    "C:/Windows/Fonts/arial.ttf",
+    "C:/Windows/Fonts/meiryo.ttc",
+    "C:/Windows/Fonts/msgothic.ttc",
+)
+
+
+@lru_cache(maxsize=16)
 def _load_font(size: int) -> ImageFont.ImageFont:
     """
     環境差があるので、よくあるフォントを順番に試す。
     見つからなければデフォルトフォント（小さい）になる。
+    サイズ毎に一度だけ探す（描画の度にファイルを開き直さない）。
     """
-    candidates = [
-        "arial.ttf",                 # Windowsでよくある
-        "meiryo.ttc",                # 日本語環境
-        "msgothic.ttc",              # 日本語環境
-        "C:/Windows/Fonts/arial.ttf",
-        "C:/Windows/Fonts/meiryo.ttc",
-        "C:/Windows/Fonts/msgothic.ttc",
-    ]
-    for path in candidates:
+    for path in _FONT_CANDIDATES:
         try:
             return ImageFont.truetype(path, size)
         except Exception:
@@ -27,21 +32,8 @@ def _load_font(size: int) -> ImageFont.ImageFont:
     return ImageFont.load_default()
 
 
-def render_gomoku_png(
-    game: GomokuGame,
-    *,
-    cell: int = 56,      # 交点間の距離（少し大きめ）
-    margin: int = 80,    # ラベル用余白（少し大きめ）
-) -> BytesIO:
-    """
-    五目盤面をPNGで生成して BytesIO を返す。
-    - 交点上に石を置く（升目中心ではない）
-    - 上と左に座標ラベル
-    - 最終手を赤枠でハイライト
-    """
-    n = game.size
-
-    # 盤面は「n本の線」= 交点は n×n、全長は (n-1)*cell
+def _build_board_template(n: int, cell: int, margin: int) -> Image.Image:
+    """背景・盤の線・座標ラベルを描いた画像（盤サイズ・寸法が同じなら毎回同じ）"""
     board_px = (n - 1) * cell
     left = margin
     top = margin
@@ -54,16 +46,12 @@ def render_gomoku_png(
     w = margin * 2 + board_px
     h = margin * 2 + board_px + status_h
 
-    # 背景（将棋盤っぽい色）
-    img = Image.new("RGBA", (w, h), (245, 236, 210, 255))
+    # 背景（将棋盤っぽい色）。透明な所はないので RGB で持つ
+    img = Image.new("RGB", (w, h), (245, 236, 210))
     d = ImageDraw.Draw(img)
 
-    # フォント（数字は見やすく2倍くらいに）
-    font_label = _load_font(28)   # ←大きく
-    font_status = _load_font(26)  # ←大きく
-
     # 線の色
-    line_color = (70, 70, 70, 255)
+    line_color = (70, 70, 70)
 
     # n本の縦線・横線（交点式）
     for i in range(n):
@@ -72,62 +60,121 @@ def render_gomoku_png(
         d.line([x, top, x, bottom], fill=line_color, width=2)
         d.line([left, y, right, y], fill=line_color, width=2)
 
-    # 交点座標
-    def pt(ix: int, iy: int) -> tuple[int, int]:
-        return (left + ix * cell, top + iy * cell)
-
     # 座標ラベル（上と左）
     # 上: x位置に合わせて、上に配置
     # 左: y位置に合わせて、左に配置
+    font_label = _load_font(28)  # 数字は見やすく大きめ
     for i in range(n):
         label = str(i + 1)
-
-        # 上
-        x, _ = pt(i, 0)
         # 文字幅に応じて中央寄せ（ざっくり）
         tw = d.textlength(label, font=font_label)
-        d.text((x - tw / 2, top - 52), label, fill=(15, 15, 15, 255), font=font_label)
+
+        # 上
+        x = left + i * cell
+        d.text((x - tw / 2, top - 52), label, fill=(15, 15, 15), font=font_label)
 
         # 左
-        _, y = pt(0, i)
-        tw = d.textlength(label, font=font_label)
-        d.text((left - 52 - tw / 2, y - 18), label, fill=(15, 15, 15, 255), font=font_label)
+        y = top + i * cell
+        d.text((left - 52 - tw / 2, y - 18), label, fill=(15, 15, 15), font=font_label)
+
+    return img
+
+
+@lru_cache(maxsize=16)
+def _stone_sprites(radius: int) -> tuple[Image.Image, Image.Image, Image.Image]:
+    """
+    (黒石, 白石, 最終手の赤リング) の画像。周りは透明で、自身をマスクにして左上を (cx - radius, cy - radius)
+    （リングは (cx - radius - 6, cy - radius - 6)）に合わせて貼る。半径毎に一度だけ描く。
+    """
+    size = 2 * radius + 1
+    black = Image.new("RGBA", (size, size), (0, 0, 0, 0))
+    ImageDraw.Draw(black).ellipse(
+        [0, 0, 2 * radius, 2 * radius], fill=(25, 25, 25, 255), outline=(10, 10, 10, 255), width=3
+    )
+    white = Image.new("RGBA", (size, size), (0, 0, 0, 0))
+    ImageDraw.Draw(white).ellipse(
+        [0, 0, 2 * radius, 2 * radius], fill=(250, 250, 250, 255), outline=(30, 30, 30, 255), width=3
+    )
+    ring = Image.new("RGBA", (size + 12, size + 12), (0, 0, 0, 0))
+    ImageDraw.Draw(ring).ellipse([0, 0, 2 * radius + 12, 2 * radius + 12], outline=(220, 40, 40, 255), width=5)
+    return black, white, ring
+
+
+# (n, cell, margin) -> テンプレート。bot で選べる盤サイズ分は import 時に作っておく
+_BOARD_TEMPLATES: dict[tuple[int, int, int], Image.Image] = {
+    (n, 56, 80): _build_board_template(n, 56, 80) for n in (9, 11, 13, 15)
+}
+
+
+def _board_template(n: int, cell: int, margin: int) -> Image.Image:
+    key = (n, cell, margin)
+    img = _BOARD_TEMPLATES.get(key)
+    if img is None:
+        img = _BOARD_TEMPLATES[key] = _build_board_template(n, cell, margin)
+    return img
+
+
+def render_gomoku_png(
+    game: GomokuGame,
+    *,
+    cell: int = 56,      # 交点間の距離（少し大きめ）
+    margin: int = 80,    # ラベル用余白（少し大きめ）
+) -> bytes:
+    """
+    五目盤面をPNGで生成して bytes を返す。
+    - 交点上に石を置く（升目中心ではない）
+    - 上と左に座標ラベル
+    - 最終手を赤枠でハイライト
+    """
+    n = game.size
+
+    # 盤面は「n本の線」= 交点は n×n、全長は (n-1)*cell
+    board_px = (n - 1) * cell
+    left = margin
+    top = margin
+    bottom = top + board_px
+
+    # 背景・線・座標ラベルは使い回しのテンプレートをコピーする
+    img = _board_template(n, cell, margin).copy()
+    d = ImageDraw.Draw(img)
+
+    font_status = _load_font(26)  # ←大きく
+
+    # 交点座標
+    def pt(ix: int, iy: int) -> tuple[int, int]:
+        return (left + ix * cell, top + iy * cell)
 
     # 石（交点上）
     # cellに対して半径を決める（線が見えるように少し小さめ）
     radius = int(cell * 0.42)
 
-    last = game.last_move  # (x,y) 0-index
-
-    for y in range(n):
-        for x in range(n):
-            v = game.board[y][x]
-            if v == EMPTY:
-                continue
+    black, white, ring = _stone_sprites(radius)
 
-            cx, cy = pt(x, y)
-            bbox = [cx - radius, cy - radius, cx + radius, cy + radius]
+    last = game.last_move  # (x,y) 0-index
 
-            if v == X:
-                fill = (25, 25, 25, 255)
-                outline = (10, 10, 10, 255)
-            else:
-                fill = (250, 250, 250, 255)
-                outline = (30, 30, 30, 255)
+    # 空きマスは見ない（石は重ならないので描く順は問わない）
+    # 石は描き済みの画像を貼るだけ（楕円を毎回塗らない）
+    # 描画は別スレッドで走り、その間もイベントループ側で石が置かれる（外される）ので、盤面と石の一覧は写してから読む
+    board = bytes(game.board)
+    for x, y in tuple(game.stones):
+        v = board[y * n + x]
+        if not v:
+            continue
 
-            d.ellipse(bbox, fill=fill, outline=outline, width=3)
+        cx, cy = pt(x, y)
+        sprite = black if v == X else white
+        img.paste(sprite, (cx - radius, cy - radius), sprite)
 
-            # 最終手ハイライト（赤リング）
-            if last and (x, y) == last:
-                hl = [cx - radius - 6, cy - radius - 6, cx + radius + 6, cy + radius + 6]
-                d.ellipse(hl, outline=(220, 40, 40, 255), width=5)
+        # 最終手ハイライト（赤リング）
+        if last and (x, y) == last:
+            img.paste(ring, (cx - radius - 6, cy - radius - 6), ring)
 
     # ステータス
     status = game.status_line()
-    d.text((margin, bottom + 12), status, fill=(10, 10, 10, 255), font=font_status)
+    d.text((margin, bottom + 12), status, fill=(10, 10, 10), font=font_status)
 
     # 出力
     bio = BytesIO()
-    img.save(bio, format="PNG")
-    bio.seek(0)
-    return bio
+    # ファイルサイズより符号化の速さを優先する（既定の level 6 の半分ほどの時間になる代わりに、PNG はおよそ倍の大きさになる）
+    img.save(bio, format="PNG", compress_level=1, optimize=False)
+    return bio.getvalue()
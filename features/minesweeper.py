@@ -1,8 +1,8 @@
 import random
 from dataclasses import dataclass
-from collections import deque
+from functools import lru_cache
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class MSConfig:
     size: int
     bomb_rate: float
@@ -27,11 +27,8 @@ NUM_EMOJI = {
     8: ":eight:",
 }
 DEFAULT_BOMB_EMOJI = ":bomb:"
-
-# 状態表現
-UNKNOWN = None          # 未開示
-FLAG = -9               # 爆弾確定（旗）
-# 開示済みは 0..8 を入れる
+# 伏せ字にした数字（セル毎に f-string を作らない）
+_SPOILER_NUM_EMOJI = {v: f"||{e}||" for v, e in NUM_EMOJI.items()}
 
 def _in_bounds(n: int, x: int, y: int) -> bool:
     return 0 <= x < n and 0 <= y < n
@@ -43,103 +40,159 @@ def _neighbors(x: int, y: int):
         (x-1, y+1), (x, y+1), (x+1, y+1),
     ]
 
-def _reveal_with_zero_flood(grid, state, x, y):
-    """(x,y) を開ける。0なら連鎖的に周囲も開ける（本来のマインスイーパー挙動）"""
-    n = len(grid)
-    q = deque()
-    q.append((x, y))
+@lru_cache(maxsize=None)
+def _neighbor_table(n: int):
+    """[x][y] -> 盤内の8近傍だけのタプル（盤サイズ毎に一度だけ作る）"""
+    return tuple(
+        tuple(
+            tuple((nx, ny) for nx, ny in _neighbors(x, y) if _in_bounds(n, nx, ny))
+            for y in range(n)
+        )
+        for x in range(n)
+    )
 
-    while q:
-        cx, cy = q.popleft()
-        if not _in_bounds(n, cx, cy):
-            continue
-        if state[cx][cy] is not UNKNOWN:
-            continue
-        if grid[cx][cy] == -1:
-            # ソルバー検査中に爆弾を開けることは「論理破綻」なので弾く
-            raise RuntimeError("Solver tried to reveal a bomb (invalid state).")
-        state[cx][cy] = grid[cx][cy]
-        if grid[cx][cy] == 0:
-            for nx, ny in _neighbors(cx, cy):
-                if _in_bounds(n, nx, ny) and state[nx][ny] is UNKNOWN:
-                    q.append((nx, ny))
-
-def _apply_basic_deductions(grid, state):
+@lru_cache(maxsize=None)
+def _bit_layout(n: int):
     """
-    基本2規則で推論を進める。
-    進展があれば True, なければ False を返す。
+    ビットボードの配置。(x,y) は bit x*w + y（w = n+1）。
+    行の間に常に0の1ビットを挟むので、8近傍へのシフトが隣の行へ回り込まない。
+    戻り値: (盤内マスのビット, 8近傍へのシフト量, [x][y] -> そのマスのビット)
+    盤サイズ毎に一度だけ作り、再試行の度に組み立て直さない。
     """
-    n = len(grid)
-    progressed = False
-
+    w = n + 1
+    inside = 0
     for x in range(n):
-        for y in range(n):
-            v = state[x][y]
-            if v is UNKNOWN or v == FLAG:
-                continue
-            if not (0 <= v <= 8):
-                continue
-
-            unknowns = []
-            flagged = 0
-            for nx, ny in _neighbors(x, y):
-                if not _in_bounds(n, nx, ny):
-                    continue
-                sv = state[nx][ny]
-                if sv is UNKNOWN:
-                    unknowns.append((nx, ny))
-                elif sv == FLAG:
-                    flagged += 1
-
-            if not unknowns:
-                continue
-
-            # 規則1: 旗が数字と同数なら残りは全部安全
-            if flagged == v:
-                for ux, uy in unknowns:
-                    _reveal_with_zero_flood(grid, state, ux, uy)
-                    progressed = True
-
-            # 規則2: 未確定 + 旗 = 数字 なら未確定は全部爆弾
-            elif flagged + len(unknowns) == v:
-                for ux, uy in unknowns:
-                    if state[ux][uy] is UNKNOWN:
-                        state[ux][uy] = FLAG
-                        progressed = True
+        inside |= ((1 << n) - 1) << (x * w)
+    cell_bits = tuple(tuple(1 << (x * w + y) for y in range(n)) for x in range(n))
+    return inside, (1, w - 1, w, w + 1), cell_bits
+
+def _dilate(bits: int, inside: int, shifts) -> int:
+    """bits の各マスの8近傍（盤内）"""
+    out = 0
+    for s in shifts:
+        out |= bits << s | bits >> s
+    return out & inside
+
+def _count_planes(bits: int, inside: int, shifts):
+    """
+    各マスについて、8近傍のうち bits に入っているマスの数を4枚のビット面（1,2,4,8の位）で返す。
+    全マス分を一度に足し算する（ビット毎の全加算器）。
+    """
+    c0 = c1 = c2 = c3 = 0
+    for s in shifts:
+        for b in (bits << s & inside, bits >> s):
+            carry = c0 & b
+            c0 ^= b
+            carry2 = c1 & carry
+            c1 ^= carry
+            c3 |= c2 & carry2
+            c2 ^= carry2
+    return c0, c1, c2, c3
+
+def _equal_planes(a, b) -> int:
+    """2つの4ビット面が等しいマス"""
+    return ~((a[0] ^ b[0]) | (a[1] ^ b[1]) | (a[2] ^ b[2]) | (a[3] ^ b[3]))
+
+def _quick_reject(bombs: int, start: int, inside: int, shifts) -> bool:
+    """
+    推論を回すまでもなく解けない盤面か（True なら解けない）。
+    safe 外の爆弾でないマスで、周りが全部爆弾のものは、開いた隣ができないので推論でも0連鎖でも開かない。
+    """
+    safe_cells = inside & ~bombs
+    return bool(safe_cells & ~start & ~_dilate(safe_cells, inside, shifts))
 
-    return progressed
+def _flood(revealed: int, new: int, zeros: int, inside: int, shifts) -> int:
+    """new を開ける。0のマスからは周囲も連鎖的に開ける（本来のマインスイーパー挙動）"""
+    new &= ~revealed
+    while new:
+        revealed |= new
+        new = _dilate(new & zeros, inside, shifts) & ~revealed
+    return revealed
 
 def is_solvable_no_guess(grid, safe, *, use_zero_flood=True, max_steps=10000) -> bool:
     """
     「推測なしで解けるか」を検査。
     ここでの推測なし = 基本2規則（+0連鎖開示）だけで最後まで開けられること。
+    盤面はビットボード（マス毎の1ビットを並べた int）にして、全マス分の推論を一度に進める。
     """
     n = len(grid)
-    state = [[UNKNOWN for _ in range(n)] for _ in range(n)]
-
-    try:
-        for (x, y) in safe:
-            if grid[x][y] == -1:
-                return False
-            if use_zero_flood:
-                _reveal_with_zero_flood(grid, state, x, y)
-            else:
-                state[x][y] = grid[x][y]
-    except RuntimeError:
+    cell_bits = _bit_layout(n)[2]
+
+    bombs = 0
+    zeros = 0
+    n0 = n1 = n2 = n3 = 0  # 数字の 1,2,4,8 の位
+    for x in range(n):
+        row = grid[x]
+        bits = cell_bits[x]
+        for y in range(n):
+            v = row[y]
+            if v <= 0:
+                if v:
+                    bombs |= bits[y]
+                else:
+                    zeros |= bits[y]
+                continue
+            bit = bits[y]
+            if v & 1:
+                n0 |= bit
+            if v & 2:
+                n1 |= bit
+            if v & 4:
+                n2 |= bit
+            if v & 8:
+                n3 |= bit
+
+    start = 0
+    for (x, y) in safe:
+        start |= cell_bits[x][y]
+    if start & bombs:
+        return False
+    return _solve_bits(n, bombs, zeros, (n0, n1, n2, n3), start, use_zero_flood, max_steps)
+
+# 同じ盤面（爆弾・数字・safe が同じ）は結果も同じなので、再試行をまたいで覚えておく
+@lru_cache(maxsize=1024)
+def _solve_bits(n: int, bombs: int, zeros: int, numbers, start: int, use_zero_flood: bool, max_steps: int) -> bool:
+    """is_solvable_no_guess の本体（盤面はビットボードで受け取る）"""
+    inside, shifts, _ = _bit_layout(n)
+    if _quick_reject(bombs, start, inside, shifts):
         return False
 
+    # safe 全体を一度に開ける（0の連鎖はどこから始めても同じ所まで広がる）
+    revealed = _flood(0, start, zeros, inside, shifts) if use_zero_flood else start
+    # 爆弾以外が全部開いたら、残りの推論（旗を立てるだけ）は結果を変えないのでそこで止める
+    if revealed | bombs == inside:
+        return True
+
+    flagged = 0
+    # 近傍の旗の数・未開示（未確定 + 旗）の数。入力が変わった方だけ数え直す
+    # （旗が増えなかったパスの後は旗の数は同じ、開けなかったパスの後は未開示の数は同じ）
+    flag_count = (0, 0, 0, 0)
+    hidden_count = _count_planes(inside & ~revealed, inside, shifts)
     steps = 0
     while steps < max_steps:
         steps += 1
-        progressed = _apply_basic_deductions(grid, state)
-        if not progressed:
+        unknown = inside & ~revealed & ~flagged
+        # 規則1: 旗が数字と同数なら残りは全部安全
+        rule1 = revealed & _equal_planes(flag_count, numbers)
+        # 規則2: 未確定 + 旗 = 数字 なら未確定は全部爆弾
+        rule2 = revealed & _equal_planes(hidden_count, numbers)
+        to_reveal = _dilate(rule1, inside, shifts) & unknown
+        to_flag = _dilate(rule2, inside, shifts) & unknown
+        if not (to_reveal or to_flag):
             break
-
-    for x in range(n):
-        for y in range(n):
-            if grid[x][y] != -1 and state[x][y] in (UNKNOWN, FLAG):
-                return False
-    return True
+        if to_reveal & bombs:
+            # ソルバー検査中に爆弾を開けることは「論理破綻」なので弾く
+            return False
+        if to_flag:
+            flagged |= to_flag
+            flag_count = _count_planes(flagged, inside, shifts)
+        if to_reveal:
+            revealed = _flood(revealed, to_reveal, zeros, inside, shifts)
+            if revealed | bombs == inside:
+                return True
+            hidden_count = _count_planes(inside & ~revealed, inside, shifts)
+
+    return revealed | bombs == inside
 
 def _make_safe_set(n: int, safe_radius: int):
     cx = cy = n // 2
@@ -151,16 +204,30 @@ def _make_safe_set(n: int, safe_radius: int):
                 safe.add((x, y))
     return safe
 
+def _place_bombs(n: int, candidates, b: int, nbr):
+    """
+    candidates から b 個選んで爆弾（-1）にし、周りの数字も書いた grid を返す。
+    爆弾を置くのと同じループで8近傍に1ずつ足す（後から置いた爆弾は -1 で上書きされる）
+    """
+    grid = [[0] * n for _ in range(n)]
+    for x, y in random.sample(candidates, b):
+        grid[x][y] = -1
+        for nx, ny in nbr[x][y]:
+            row = grid[nx]
+            if row[ny] != -1:
+                row[ny] += 1
+    return grid
+
 def _to_discord_text(grid, safe, header: str, *, bomb_emoji: str) -> str:
     n = len(grid)
     SEP = "\u200b"  # spoiler同士がくっついて |||| にならないようにする
-    lines = []
-    for y in range(n):
-        row = []
-        for x in range(n):
-            cell = bomb_emoji if grid[x][y] == -1 else NUM_EMOJI[grid[x][y]]
-            row.append(cell if (x, y) in safe else f"||{cell}||")
-        lines.append(SEP.join(row))
+    # grid の値 -> 表示（爆弾 -1 の分だけ呼び出し毎に足す）
+    shown = {**NUM_EMOJI, -1: bomb_emoji}
+    hidden = {**_SPOILER_NUM_EMOJI, -1: f"||{bomb_emoji}||"}
+    lines = [
+        SEP.join((shown if (x, y) in safe else hidden)[grid[x][y]] for x in range(n))
+        for y in range(n)
+    ]
     return header + "\n".join(lines)
 
 def generate_board_text(
@@ -175,28 +242,15 @@ def generate_board_text(
     cfg = DIFFICULTY[difficulty]
     n = cfg.size
     safe = _make_safe_set(n, cfg.safe_radius)
+    nbr = _neighbor_table(n)
+
+    # 爆弾の数は割合から一度だけ決める（マス毎に抽選すると数がばらつき、解けない盤面で再試行が増える）
+    candidates = [(x, y) for x in range(n) for y in range(n) if (x, y) not in safe]
+    b = max(1, round(cfg.bomb_rate * len(candidates)))
 
     for _ in range(max_tries):
-        grid = [[0 for _ in range(n)] for _ in range(n)]
-
-        # 爆弾配置（割合）
-        for x in range(n):
-            for y in range(n):
-                if (x, y) in safe:
-                    continue
-                if random.random() < cfg.bomb_rate:
-                    grid[x][y] = -1
-
-        # 数字計算
-        for x in range(n):
-            for y in range(n):
-                if grid[x][y] == -1:
-                    continue
-                cnt = 0
-                for nx, ny in _neighbors(x, y):
-                    if _in_bounds(n, nx, ny) and grid[nx][ny] == -1:
-                        cnt += 1
-                grid[x][y] = cnt
+        # 爆弾配置 + 数字計算
+        grid = _place_bombs(n, candidates, b, nbr)
 
         # safe内に0が無いと面白さが減るので、あればOK
         if safe and all(grid[x][y] != 0 for (x, y) in safe):
@@ -206,12 +260,7 @@ def generate_board_text(
         if not is_solvable_no_guess(grid, safe):
             continue
 
-        actual_bombs = sum(
-            1 for x in range(n) for y in range(n)
-            if grid[x][y] == -1
-        )
-
-        header = f"[{difficulty}] size={n} bombs={actual_bombs}\n"
+        header = f"[{difficulty}] size={n} bombs={b}\n"
         text = _to_discord_text(grid, safe, header, bomb_emoji=bomb_emoji)
 
         if len(text) <= 1500:
@@ -244,21 +293,9 @@ def generate_board_text_custom(
     if b > max_bombs:
         return f"bombs が多すぎます。最大 {max_bombs}（safeエリア除外）です。"
 
+    nbr = _neighbor_table(n)
     for _ in range(max_tries):
-        grid = [[0 for _ in range(n)] for _ in range(n)]
-
-        for (x, y) in random.sample(candidates, b):
-            grid[x][y] = -1
-
-        for x in range(n):
-            for y in range(n):
-                if grid[x][y] == -1:
-                    continue
-                cnt = 0
-                for nx, ny in _neighbors(x, y):
-                    if _in_bounds(n, nx, ny) and grid[nx][ny] == -1:
-                        cnt += 1
-                grid[x][y] = cnt
+        grid = _place_bombs(n, candidates, b, nbr)
 
         if b > 0 and safe and all(grid[x][y] != 0 for (x, y) in safe):
             continue
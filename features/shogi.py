@@ -10,14 +10,123 @@ PROMOTABLE = {"P", "L", "N", "S", "B", "R"}
 HAND_ORDER = ["R", "B", "G", "S", "N", "L", "P"]
 
 
-@dataclass
+@dataclass(slots=True)
 class Piece:
     owner: int
     kind: str
     promoted: bool = False
 
 
-@dataclass
+# 盤面の1マス = 1バイト。0 = 空き、下位4ビット = 駒の種類、0x10 = 成り、0x20 = 後手の駒
+_KIND_CODE = {"P": 1, "L": 2, "N": 3, "S": 4, "G": 5, "B": 6, "R": 7, "K": 8}
+_CODE_KIND = {v: k for k, v in _KIND_CODE.items()}
+_P, _L, _N, _S, _G, _B, _R, _K = range(1, 9)
+_KIND_MASK = 0x0F
+_PROMOTED = 0x10
+_GOTE_BIT = 0x20
+_PROMOTABLE_CODES = {_KIND_CODE[k] for k in PROMOTABLE}
+
+
+# 金・銀・桂の動ける (dx, dy)。step = 前の向き（先手 +1 / 後手 -1）毎に作っておく
+_GOLD_MOVES = {
+    step: frozenset({(0, step), (-1, step), (1, step), (-1, 0), (1, 0), (0, -step)}) for step in (1, -1)
+}
+_SILVER_MOVES = {
+    step: frozenset({(0, step), (-1, step), (1, step), (-1, -step), (1, -step)}) for step in (1, -1)
+}
+_KNIGHT_MOVES = {step: frozenset({(-1, 2 * step), (1, 2 * step)}) for step in (1, -1)}
+
+
+def _line_rays(n: int) -> list[tuple[tuple[int, ...], ...]]:
+    """
+    [y * n + x][(sx + 1) * 3 + (sy + 1)] -> (x,y) から (sx, sy) 方向に盤端まで進んだマスの添字。
+    sx, sy は -1/0/1（(0, 0) の所は空）。
+    """
+    out = []
+    for y in range(n):
+        for x in range(n):
+            rays = []
+            for sx in (-1, 0, 1):
+                for sy in (-1, 0, 1):
+                    ray = []
+                    cx, cy = x + sx, y + sy
+                    while (sx or sy) and 0 <= cx < n and 0 <= cy < n:
+                        ray.append(cy * n + cx)
+                        cx += sx
+                        cy += sy
+                    rays.append(tuple(ray))
+            out.append(tuple(rays))
+    return out
+
+
+_LINE_RAYS = {9: _line_rays(9)}
+
+
+def _attack_codes() -> tuple[dict[int, tuple[frozenset[int], ...]], dict[int, tuple[frozenset[int], ...]]]:
+    """
+    利きを王の側から逆に引く表。attacker 毎に、_line_rays と同じ方向の添字 (sx + 1) * 3 + (sy + 1) で
+    - near[attacker][dir]: (tx+sx, ty+sy) に居れば (tx,ty) に利く駒のコード
+    - far[attacker][dir]: その方向に2マス以上離れていても（間が空いていれば）利く駒のコード（飛び駒）
+    桂は隣から利かないのでどちらにも入らない（_is_square_attacked で別に見る）。
+    """
+    near: dict[int, tuple[frozenset[int], ...]] = {}
+    far: dict[int, tuple[frozenset[int], ...]] = {}
+    for attacker in (SENTE, GOTE):
+        step = 1 if attacker == SENTE else -1
+        near_dirs = []
+        far_dirs = []
+        for sx in (-1, 0, 1):
+            for sy in (-1, 0, 1):
+                # 駒から (tx,ty) への向き
+                dx, dy = -sx, -sy
+                diag = dx != 0 and dy != 0
+                near_codes = set()
+                far_codes = set()
+                for kind in range(_P, _K + 1) if sx or sy else ():
+                    for promoted in (0, _PROMOTED) if kind in _PROMOTABLE_CODES else (0,):
+                        code = kind | promoted | (_GOTE_BIT if attacker == GOTE else 0)
+                        if kind == _K:
+                            adj = True
+                        elif kind == _G or (promoted and kind in (_P, _L, _N, _S)):
+                            adj = (dx, dy) in _GOLD_MOVES[step]
+                        elif kind == _S:
+                            adj = (dx, dy) in _SILVER_MOVES[step]
+                        elif kind == _P:
+                            adj = (dx, dy) == (0, step)
+                        elif kind == _L:
+                            # _can_piece_move と同じく、香は筋の上なら向きを見ない
+                            adj = dx == 0
+                        elif kind == _B:
+                            adj = diag or bool(promoted)
+                        elif kind == _R:
+                            adj = not diag or bool(promoted)
+                        else:
+                            adj = False
+                        if adj:
+                            near_codes.add(code)
+                        if (kind == _L and not promoted and dx == 0) or (
+                            kind == _B and diag
+                        ) or (kind == _R and not diag):
+                            far_codes.add(code)
+                near_dirs.append(frozenset(near_codes))
+                far_dirs.append(frozenset(far_codes))
+        near[attacker] = tuple(near_dirs)
+        far[attacker] = tuple(far_dirs)
+    return near, far
+
+
+_NEAR_ATTACKERS, _FAR_ATTACKERS = _attack_codes()
+
+
+def _piece_code(owner: int, kind: str, promoted: bool = False) -> int:
+    return _KIND_CODE[kind] | (_PROMOTED if promoted else 0) | (_GOTE_BIT if owner == GOTE else 0)
+
+
+def _owner_of(code: int) -> int:
+    return GOTE if code & _GOTE_BIT else SENTE
+
+
+@dataclass(slots=True)
 class PendingMove:
     from_x: int
     from_y: int
@@ -25,7 +134,7 @@ class PendingMove:
     to_y: int
 
 
-@dataclass
+@dataclass(slots=True)
 class ShogiGame:
     player_sente: int
     player_gote: int
@@ -34,12 +143,21 @@ class ShogiGame:
     finished: bool = False
     winner: Optional[int] = None
     last_move: Optional[tuple[int, int]] = None
+    move_count: int = 0
     pending_move: Optional[PendingMove] = None
-    board: list[list[Optional[Piece]]] = field(default_factory=list)
+    # board[y * size + x] = 駒のコード（_piece_code）。描画などからは piece_at で Piece として読む
+    board: bytearray = field(default_factory=bytearray)
     hands: dict[int, dict[str, int]] = field(default_factory=dict)
+    # 描画キャッシュ: ((move_count, finished, winner), PNG bytes)
+    _png_cache: Optional[tuple[tuple, bytes]] = field(default=None, init=False, repr=False)
+    # 王手放置の判定で手を試す盤面。合法なら board と入れ替える（board は描画スレッドからも読まれるので直接いじらない）
+    _trial: bytearray = field(default_factory=bytearray, init=False, repr=False)
+    # 王の位置（board と一緒に更新する。王手の判定で王を探して81マスを舐めない）
+    _king_pos: dict[int, tuple[int, int]] = field(default_factory=dict, init=False, repr=False)
 
     def __post_init__(self) -> None:
-        self.board = [[None for _ in range(self.size)] for _ in range(self.size)]
+        self.board = bytearray(self.size * self.size)
+        self._trial = bytearray(self.size * self.size)
         self.hands = {
             SENTE: {k: 0 for k in HAND_ORDER},
             GOTE: {k: 0 for k in HAND_ORDER},
@@ -50,19 +168,33 @@ class ShogiGame:
         # 先手を上側、後手を下側に置く（要件の成りゾーン: 先手7-9段, 後手1-3段 に合わせる）
         top = ["L", "N", "S", "G", "K", "G", "S", "N", "L"]
         bot = ["L", "N", "S", "G", "K", "G", "S", "N", "L"]
+        n = self.size
         for x, k in enumerate(top):
-            self.board[0][x] = Piece(SENTE, k)
-        self.board[1][1] = Piece(SENTE, "R")
-        self.board[1][7] = Piece(SENTE, "B")
+            self.board[0 * n + x] = _piece_code(SENTE, k)
+        self.board[1 * n + 1] = _piece_code(SENTE, "R")
+        self.board[1 * n + 7] = _piece_code(SENTE, "B")
         for x in range(9):
-            self.board[2][x] = Piece(SENTE, "P")
+            self.board[2 * n + x] = _piece_code(SENTE, "P")
 
         for x in range(9):
-            self.board[6][x] = Piece(GOTE, "P")
-        self.board[7][1] = Piece(GOTE, "B")
-        self.board[7][7] = Piece(GOTE, "R")
+            self.board[6 * n + x] = _piece_code(GOTE, "P")
+        self.board[7 * n + 1] = _piece_code(GOTE, "B")
+        self.board[7 * n + 7] = _piece_code(GOTE, "R")
         for x, k in enumerate(bot):
-            self.board[8][x] = Piece(GOTE, k)
+            self.board[8 * n + x] = _piece_code(GOTE, k)
+
+        self._king_pos = {}
+        for i, p in enumerate(self.board):
+            if p & _KIND_MASK == _K:
+                y, x = divmod(i, n)
+                self._king_pos[_owner_of(p)] = (x, y)
+
+    def piece_at(self, x: int, y: int) -> Optional[Piece]:
+        """(x,y) の駒（0-index）。盤面は駒を持たないので、その都度 Piece を作って返す"""
+        code = self.board[y * self.size + x]
+        if not code:
+            return None
+        return Piece(_owner_of(code), _CODE_KIND[code & _KIND_MASK], bool(code & _PROMOTED))
 
     def current_player_id(self) -> int:
         return self.player_sente if self.turn == SENTE else self.player_gote
@@ -91,16 +223,16 @@ class ShogiGame:
         if not self._inside(fx, fy) or not self._inside(tx, ty):
             return False, "座標は 1..9 で指定してください。", False
 
-        piece = self.board[fy][fx]
-        if piece is None:
+        piece = self.board[fy * self.size + fx]
+        if not piece:
             return False, "移動元に駒がありません。", False
-        if piece.owner != self.turn:
+        if _owner_of(piece) != self.turn:
             return False, "自分の駒を動かしてください。", False
         if not self._can_piece_move(self.board, piece, fx, fy, tx, ty):
             return False, "その駒はその位置へ移動できません。", False
 
-        dest = self.board[ty][tx]
-        if dest is not None and dest.owner == self.turn:
+        dest = self.board[ty * self.size + tx]
+        if dest and _owner_of(dest) == self.turn:
             return False, "味方の駒があるマスには移動できません。", False
 
         forced = self._is_forced_promotion(piece, ty)
@@ -139,7 +271,7 @@ class ShogiGame:
             return False, "王(ou)は打てません。", False
         if not self._inside(tx, ty):
             return False, "座標は 1..9 で指定してください。", False
-        if self.board[ty][tx] is not None:
+        if self.board[ty * self.size + tx]:
             return False, "そのマスには駒があります。", False
         if self.hands[self.turn][kind] <= 0:
             return False, f"持ち駒に {kind} がありません。", False
@@ -157,60 +289,72 @@ class ShogiGame:
         return ok, msg, False
 
     def _apply_move(self, fx: int, fy: int, tx: int, ty: int, promote: bool) -> tuple[bool, str, bool]:
-        piece = self.board[fy][fx]
-        assert piece is not None
-
-        trial = self._clone_board(self.board)
-        moving = trial[fy][fx]
-        assert moving is not None
-        captured = trial[ty][tx]
-        trial[fy][fx] = None
-
-        if promote and moving.kind in PROMOTABLE and not moving.promoted:
-            moving.promoted = True
-        trial[ty][tx] = moving
-
-        if self._is_king_in_check_on_board(trial, moving.owner):
+        n = self.size
+        moving = self.board[fy * n + fx]
+        assert moving
+
+        trial = self._trial
+        trial[:] = self.board
+        captured = trial[ty * n + tx]
+        trial[fy * n + fx] = 0
+
+        if promote and moving & _KIND_MASK in _PROMOTABLE_CODES:
+            moving |= _PROMOTED
+        trial[ty * n + tx] = moving
+
+        owner = _owner_of(moving)
+        is_king = moving & _KIND_MASK == _K
+        king_pos = (tx, ty) if is_king else self._king_pos.get(owner)
+        if self._is_king_in_check_on_board(trial, owner, king_pos):
             return False, "王手放置はできません。", False
 
-        self.board = trial
-        if captured is not None:
-            cap_kind = captured.kind
-            self.hands[moving.owner][cap_kind] += 1
+        self.board, self._trial = trial, self.board
+        if is_king:
+            self._king_pos[owner] = (tx, ty)
+        if captured:
+            cap_kind = _CODE_KIND[captured & _KIND_MASK]
+            self.hands[owner][cap_kind] += 1
             if cap_kind == "K":
+                self._king_pos.pop(-owner, None)
                 self.finished = True
-                self.winner = moving.owner
+                self.winner = owner
 
         self.last_move = (tx, ty)
         if not self.finished:
             self.turn *= -1
+        # 描画キャッシュのキーなので、盤面・手番を揃えてから最後に上げる
+        self.move_count += 1
         return True, "OK", False
 
     def _apply_drop(self, kind: str, tx: int, ty: int) -> tuple[bool, str]:
-        trial = self._clone_board(self.board)
-        trial[ty][tx] = Piece(self.turn, kind, False)
+        trial = self._trial
+        trial[:] = self.board
+        trial[ty * self.size + tx] = _piece_code(self.turn, kind)
 
-        if self._is_king_in_check_on_board(trial, self.turn):
+        if self._is_king_in_check_on_board(trial, self.turn, self._king_pos.get(self.turn)):
             return False, "王手放置はできません。"
 
-        self.board = trial
+        self.board, self._trial = trial, self.board
         self.hands[self.turn][kind] -= 1
         self.last_move = (tx, ty)
         self.turn *= -1
+        self.move_count += 1
         return True, "OK"
 
-    def _is_promotion_possible(self, piece: Piece, from_y: int, to_y: int) -> bool:
-        if piece.promoted or piece.kind not in PROMOTABLE:
+    def _is_promotion_possible(self, piece: int, from_y: int, to_y: int) -> bool:
+        if piece & _PROMOTED or piece & _KIND_MASK not in _PROMOTABLE_CODES:
             return False
-        return self._in_promo_zone(piece.owner, from_y) or self._in_promo_zone(piece.owner, to_y)
+        owner = _owner_of(piece)
+        return self._in_promo_zone(owner, from_y) or self._in_promo_zone(owner, to_y)
 
-    def _is_forced_promotion(self, piece: Piece, to_y: int) -> bool:
-        if piece.promoted:
+    def _is_forced_promotion(self, piece: int, to_y: int) -> bool:
+        if piece & _PROMOTED:
             return False
-        if piece.kind in {"P", "L"}:
-            return self._is_last_rank_for(piece.owner, to_y)
-        if piece.kind == "N":
-            return self._is_knight_dead_rank_for(piece.owner, to_y)
+        kind = piece & _KIND_MASK
+        if kind == _P or kind == _L:
+            return self._is_last_rank_for(_owner_of(piece), to_y)
+        if kind == _N:
+            return self._is_knight_dead_rank_for(_owner_of(piece), to_y)
         return False
 
     def _in_promo_zone(self, owner: int, y: int) -> bool:
@@ -224,34 +368,60 @@ class ShogiGame:
         return y >= 7 if owner == SENTE else y <= 1
 
     def _has_unpromoted_pawn_on_file(self, owner: int, x: int) -> bool:
-        for y in range(self.size):
-            p = self.board[y][x]
-            if p and p.owner == owner and p.kind == "P" and not p.promoted:
-                return True
-        return False
+        # 成っていない歩はコードが一意に決まるので、筋のバイトと1回比べるだけでよい
+        pawn = _piece_code(owner, "P")
+        n = self.size
+        return pawn in self.board[x::n]
 
-    def _is_king_in_check_on_board(self, board: list[list[Optional[Piece]]], owner: int) -> bool:
-        king_pos = self._find_king(board, owner)
+    def _is_king_in_check_on_board(
+        self, board: bytearray, owner: int, king_pos: Optional[tuple[int, int]]
+    ) -> bool:
+        """king_pos は board 上の owner の王の位置（呼び出し側が手に合わせて渡す）"""
         if king_pos is None:
             return True
         kx, ky = king_pos
         return self._is_square_attacked(board, kx, ky, -owner)
 
-    def _find_king(self, board: list[list[Optional[Piece]]], owner: int) -> Optional[tuple[int, int]]:
-        for y in range(self.size):
-            for x in range(self.size):
-                p = board[y][x]
-                if p and p.owner == owner and p.kind == "K":
-                    return x, y
-        return None
-
-    def _is_square_attacked(self, board: list[list[Optional[Piece]]], tx: int, ty: int, attacker: int) -> bool:
-        for y in range(self.size):
-            for x in range(self.size):
-                p = board[y][x]
-                if p and p.owner == attacker:
-                    if self._can_piece_move(board, p, x, y, tx, ty):
+    def _is_square_attacked(self, board: bytearray, tx: int, ty: int, attacker: int) -> bool:
+        """
+        attacker の駒が (tx,ty) に利いているか。駒を全部調べず、(tx,ty) から外向きに引く:
+        8方向それぞれ最初に当たる駒が、その向き・距離から利く駒か（_NEAR_ATTACKERS / _FAR_ATTACKERS）と、
+        桂の居るはずの2マスだけを見る。
+        """
+        n = self.size
+        t = board[ty * n + tx]
+        if t and _owner_of(t) == attacker:
+            return False
+
+        near = _NEAR_ATTACKERS[attacker]
+        far = _FAR_ATTACKERS[attacker]
+        rays = _LINE_RAYS.get(n) or _line_rays(n)
+        for d, ray in enumerate(rays[ty * n + tx]):
+            if not ray:
+                continue
+            p = board[ray[0]]
+            if p:
+                if p in near[d]:
+                    return True
+                continue
+            far_codes = far[d]
+            if not far_codes:
+                continue
+            for i in ray[1:]:
+                p = board[i]
+                if p:
+                    if p in far_codes:
                         return True
+                    break
+
+        # 桂: 利く先から2段戻って左右1筋
+        knight = _piece_code(attacker, "N")
+        ky = ty - 2 * attacker
+        if 0 <= ky < n:
+            if tx > 0 and board[ky * n + tx - 1] == knight:
+                return True
+            if tx + 1 < n and board[ky * n + tx + 1] == knight:
+                return True
         return False
 
     def _inside(self, x: int, y: int) -> bool:
@@ -259,8 +429,8 @@ class ShogiGame:
 
     def _can_piece_move(
         self,
-        board: list[list[Optional[Piece]]],
-        piece: Piece,
+        board: bytearray,
+        piece: int,
         fx: int,
         fy: int,
         tx: int,
@@ -270,62 +440,57 @@ class ShogiGame:
             return False
         if not self._inside(tx, ty):
             return False
-        dest = board[ty][tx]
-        if dest is not None and dest.owner == piece.owner:
+        dest = board[ty * self.size + tx]
+        if dest and (dest ^ piece) & _GOTE_BIT == 0:
             return False
 
         dx = tx - fx
         dy = ty - fy
-        step = 1 if piece.owner == SENTE else -1
+        step = -1 if piece & _GOTE_BIT else 1
+        kind = piece & _KIND_MASK
+        promoted = piece & _PROMOTED
 
-        if piece.kind == "K":
+        if kind == _K:
             return abs(dx) <= 1 and abs(dy) <= 1
 
-        if piece.promoted and piece.kind in {"P", "L", "N", "S"}:
+        if promoted and kind in (_P, _L, _N, _S):
             return self._is_gold_move(dx, dy, step)
 
-        if piece.kind == "G":
+        if kind == _G:
             return self._is_gold_move(dx, dy, step)
 
-        if piece.kind == "S":
-            return (dx, dy) in {(0, step), (-1, step), (1, step), (-1, -step), (1, -step)}
+        if kind == _S:
+            return (dx, dy) in _SILVER_MOVES[step]
 
-        if piece.kind == "N":
-            return (dx, dy) in {(-1, 2 * step), (1, 2 * step)}
+        if kind == _N:
+            return (dx, dy) in _KNIGHT_MOVES[step]
 
-        if piece.kind == "L":
+        if kind == _L:
             return dx == 0 and self._is_clear_line(board, fx, fy, tx, ty)
 
-        if piece.kind == "P":
+        if kind == _P:
             return dx == 0 and dy == step
 
-        if piece.kind == "B":
+        if kind == _B:
             diag = abs(dx) == abs(dy) and self._is_clear_line(board, fx, fy, tx, ty)
-            if piece.promoted:
+            if promoted:
                 return diag or (abs(dx) == 1 and abs(dy) == 0) or (abs(dx) == 0 and abs(dy) == 1)
             return diag
 
-        if piece.kind == "R":
+        if kind == _R:
             straight = (dx == 0 or dy == 0) and self._is_clear_line(board, fx, fy, tx, ty)
-            if piece.promoted:
+            if promoted:
                 return straight or (abs(dx) == 1 and abs(dy) == 1)
             return straight
 
         return False
 
     def _is_gold_move(self, dx: int, dy: int, step: int) -> bool:
-        return (dx, dy) in {
-            (0, step),
-            (-1, step),
-            (1, step),
-            (-1, 0),
-            (1, 0),
-            (0, -step),
-        }
+        return (dx, dy) in _GOLD_MOVES[step]
 
     def _is_clear_line(
         self,
-        board: list[list[Optional[Piece]]],
+        board: bytearray,
         fx: int,
         fy: int,
         tx: int,
@@ -333,28 +498,17 @@ class ShogiGame:
     ) -> bool:
         dx = tx - fx
         dy = ty - fy
-        step_x = 0 if dx == 0 else (1 if dx > 0 else -1)
-        step_y = 0 if dy == 0 else (1 if dy > 0 else -1)
-
         if not (dx == 0 or dy == 0 or abs(dx) == abs(dy)):
             return False
 
-        cx, cy = fx + step_x, fy + step_y
-        while cx != tx or cy != ty:
-            if board[cy][cx] is not None:
+        n = self.size
+        rays = _LINE_RAYS.get(n) or _line_rays(n)
+        step_x = (dx > 0) - (dx < 0)
+        step_y = (dy > 0) - (dy < 0)
+        # 間のマス = その方向の線の先頭から (距離 - 1) マス
+        between = max(abs(dx), abs(dy)) - 1
+        for i in rays[fy * n + fx][(step_x + 1) * 3 + step_y + 1][:between]:
+            if board[i]:
                 return False
-            cx += step_x
-            cy += step_y
         return True
 
-    def _clone_board(self, board: list[list[Optional[Piece]]]) -> list[list[Optional[Piece]]]:
-        new_board: list[list[Optional[Piece]]] = []
-        for row in board:
-            new_row: list[Optional[Piece]] = []
-            for p in row:
-                if p is None:
-                    new_row.append(None)
-                else:
-                    new_row.append(Piece(p.owner, p.kind, p.promoted))
-            new_board.append(new_row)
-        return new_board
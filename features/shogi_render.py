@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+from functools import lru_cache
 from io import BytesIO
 from PIL import Image, ImageDraw, ImageFont
 
@@ -26,15 +27,19 @@ PROMOTED_KANJI = {
 }
 
 
+_FONT_CANDIDATES = (
+    "NotoSansCJK-Regular.ttc",
+    "NotoSansJP-Regular.otf",
+    "meiryo.ttc",
+    "msgothic.ttc",
+    "arial.ttf",
+)
+
+
+@lru_cache(maxsize=16)
 def _load_font(size: int) -> ImageFont.ImageFont:
-    candidates = [
-        "NotoSansCJK-Regular.ttc",
-        "NotoSansJP-Regular.otf",
-        "meiryo.ttc",
-        "msgothic.ttc",
-        "arial.ttf",
-    ]
-    for path in candidates:
+    """サイズ毎に一度だけ探す（描画の度に候補を開き直さない）"""
+    for path in _FONT_CANDIDATES:
         try:
             return ImageFont.truetype(path, size)
         except Exception:
@@ -48,12 +53,17 @@ def _piece_label(piece: Piece) -> str:
     return KANJI[piece.kind]
 
 
-def render_shogi_png(game: ShogiGame) -> BytesIO:
-    cell = 72
-    margin = 120
-    side_w = 220
-    status_h = 84
+@lru_cache(maxsize=64)
+def _rotated_piece_tile(label: str, cell: int, font_size: int) -> Image.Image:
+    """上側（先手）の駒の、180度回した1マス分の画像。駒の字・寸法毎に一度だけ作る"""
+    tile = Image.new("RGBA", (cell, cell), (0, 0, 0, 0))
+    td = ImageDraw.Draw(tile)
+    td.text((12, 10), label, fill=(10, 10, 10, 255), font=_load_font(font_size))
+    return tile.rotate(180)
 
+
+def _build_board_template(cell: int, margin: int, side_w: int, status_h: int) -> Image.Image:
+    """背景・盤の枠と線・座標ラベルを描いた画像（寸法が同じなら毎回同じ）"""
     board_px = 9 * cell
     left = side_w + margin
     top = margin
@@ -67,9 +77,6 @@ def render_shogi_png(game: ShogiGame) -> BytesIO:
     d = ImageDraw.Draw(img)
 
     font_coord = _load_font(34)
-    font_piece = _load_font(44)
-    font_hand = _load_font(30)
-    font_status = _load_font(30)
 
     # 盤
     d.rectangle([left, top, right, bottom], outline=(50, 40, 20, 255), width=3)
@@ -85,6 +92,44 @@ def render_shogi_png(game: ShogiGame) -> BytesIO:
         d.text((left + i * cell + (cell - tw) / 2, top - 52), txt, fill=(20, 20, 20, 255), font=font_coord)
         d.text((left - 42, top + i * cell + 14), txt, fill=(20, 20, 20, 255), font=font_coord)
 
+    return img
+
+
+# (cell, margin, side_w, status_h) -> テンプレート。import 時に作っておく
+_BOARD_TEMPLATES: dict[tuple[int, int, int, int], Image.Image] = {
+    (72, 120, 220, 84): _build_board_template(72, 120, 220, 84),
+}
+
+
+def _board_template(cell: int, margin: int, side_w: int, status_h: int) -> Image.Image:
+    key = (cell, margin, side_w, status_h)
+    img = _BOARD_TEMPLATES.get(key)
+    if img is None:
+        img = _BOARD_TEMPLATES[key] = _build_board_template(*key)
+    return img
+
+
+def render_shogi_png(game: ShogiGame) -> bytes:
+    cell = 72
+    margin = 120
+    side_w = 220
+    status_h = 84
+
+    board_px = 9 * cell
+    left = side_w + margin
+    top = margin
+    right = left + board_px
+    bottom = top + board_px
+
+    # 背景・盤・座標ラベル（textlength の計算も含む）は使い回しのテンプレートをコピーする
+    img = _board_template(cell, margin, side_w, status_h).copy()
+    d = ImageDraw.Draw(img)
+
+    piece_font_size = 44
+    font_piece = _load_font(piece_font_size)
+    font_hand = _load_font(30)
+    font_status = _load_font(30)
+
     if game.last_move:
         lx, ly = game.last_move
         d.rectangle(
@@ -95,7 +140,7 @@ def render_shogi_png(game: ShogiGame) -> BytesIO:
 
     for y in range(9):
         for x in range(9):
-            piece = game.board[y][x]
+            piece = game.piece_at(x, y)
             if piece is None:
                 continue
             label = _piece_label(piece)
@@ -105,10 +150,7 @@ def render_shogi_png(game: ShogiGame) -> BytesIO:
             if piece.owner == GOTE:
                 d.text((px, py), label, fill=(10, 10, 10, 255), font=font_piece)
             else:
-                tile = Image.new("RGBA", (cell, cell), (0, 0, 0, 0))
-                td = ImageDraw.Draw(tile)
-                td.text((12, 10), label, fill=(10, 10, 10, 255), font=font_piece)
-                tile = tile.rotate(180)
+                tile = _rotated_piece_tile(label, cell, piece_font_size)
                 img.alpha_composite(tile, dest=(left + x * cell, top + y * cell))
 
     # 持ち駒
@@ -129,6 +171,6 @@ def render_shogi_png(game: ShogiGame) -> BytesIO:
     d.text((left, bottom + 20), game.status_line(), fill=(10, 10, 10, 255), font=font_status)
 
     bio = BytesIO()
-    img.save(bio, format="PNG")
-    bio.seek(0)
-    return bio
+    # 速さ優先で弱く圧縮する（既定の level 6 より PNG は2倍強の大きさになるが、数十KBなので添付には困らない）
+    img.save(bio, format="PNG", compress_level=1, optimize=False)
+    return bio.getvalue()